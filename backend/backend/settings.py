@@ -141,6 +141,10 @@ STATIC_URL = "/static/"
 
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
+MEDIA_URL = "/media/"
+
+MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 locale.setlocale(locale.LC_TIME, "ru_RU.UTF-8")
@@ -164,3 +168,7 @@ SITE_PASSWORD = env.str("SITE_PASSWORD")
 CUSTOM_FONT = TrueTypeFont.true_type_font_from_file(
     Path("files/Source Serif Pro.ttf")
 )
+# salary.make_pdf.create_list or faster salary.make_pdf.create_fixed_list
+PDF_RENDERER = env.str("PDF_RENDERER", "salary.make_pdf.create_list")
+PDF_WORKERS = env.int("PDF_WORKERS", os.cpu_count())
+PDF_CACHE_SIZE = env.int("PDF_CACHE_SIZE", 200 * 2**20)
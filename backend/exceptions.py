@@ -4,3 +4,7 @@ class AlreadyExists(Exception):
 
 class ParseFail(Exception):
     """ParseFail."""
+
+
+class TemplateFail(Exception):
+    """Template file can not be compiled."""
@@ -1,26 +1,88 @@
 from core.models import Employee
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db.models import Q, Sum
-from django.db.utils import IntegrityError
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect
 from django.template.response import TemplateResponse
-from django.urls import path
+from django.urls import path, reverse
+from exceptions import ParseFail
+from redis.exceptions import RedisError
 from utils import add_err_messages
 
+from .file_parse import save_uploaded_report, stage_report
 from .filters import (
     DateReportFilter,
     EmployeeAccrualFilter,
     EmployeeSaleFilter,
 )
-from .forms import AccrualCsvForm, SaleCsvForm
-from .models import Accrual, Sale
-from .serializers import AccrualSerializer, SaleSerializer
+from .forms import AccrualCsvForm, BackgroundCsvForm, SaleCsvForm
+from .jobs import get_progress, submit_import
+from .models import Accrual, Sale, UploadedReport
 
 
-class AccrualAdmin(admin.ModelAdmin):
+class BackgroundImportMixin:
+    """Import the report in the import worker and show its progress."""
+
+    report_type = None
+
+    def import_background(self, request):
+        """Put the uploaded file in the queue."""
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Фоновая загрузка отчета",
+            "opts": self.model._meta,
+            "form": BackgroundCsvForm(),
+        }
+        if request.method == "POST":
+            form = BackgroundCsvForm(request.POST, request.FILES)
+            if form.is_valid():
+                try:
+                    job_id = submit_import(
+                        form.cleaned_data["csv_file"], self.report_type
+                    )
+                except RedisError:
+                    messages.error(request, "Фоновая загрузка недоступна!")
+                else:
+                    context["job_id"] = job_id
+                    context["progress_url"] = reverse(
+                        f"admin:import_{self.model._meta.model_name}_progress",
+                        args=[job_id],
+                    )
+            else:
+                add_err_messages(request, form.errors["csv_file"])
+        return TemplateResponse(request, "import_progress.html", context)
+
+    def import_progress(self, request, job_id):
+        """Get progress of the import."""
+        progress = get_progress(job_id)
+        if progress is None:
+            raise Http404("Загрузка не найдена")
+        return JsonResponse(progress)
+
+    def get_urls(self):
+        """Add background import endpoints."""
+        urls = super().get_urls()
+        model_name = self.model._meta.model_name
+        custom_urls = [
+            path(
+                f"import_{model_name}_background/",
+                self.import_background,
+                name=f"import_{model_name}_background",
+            ),
+            path(
+                f"import_{model_name}_progress/<str:job_id>/",
+                self.import_progress,
+                name=f"import_{model_name}_progress",
+            ),
+        ]
+        return custom_urls + urls
+
+
+class AccrualAdmin(BackgroundImportMixin, admin.ModelAdmin):
     """Accrual model admin site."""
 
     list_display = ("date", "employee", "name", "base", "sum")
+    report_type = UploadedReport.ReportType.ACCRUAL
     list_filter = (DateReportFilter, EmployeeAccrualFilter)
     ordering = ("-date",)
 
@@ -38,24 +100,28 @@ class AccrualAdmin(admin.ModelAdmin):
         if request.method == "POST":
             form = AccrualCsvForm(request.POST, request.FILES)
             if "db_save" in request.POST:
-                data = request.session.get("uploaded_data", [])
-                serializer = AccrualSerializer(data=data, many=True)
-                if serializer.is_valid():
-                    serializer.save()
-                    return redirect("admin:report_accrual_changelist")
+                try:
+                    inserted, skipped = save_uploaded_report(
+                        request.POST.get("upload_token"),
+                        UploadedReport.ReportType.ACCRUAL,
+                        ignore_conflicts=True,
+                    )
+                except ParseFail as e:
+                    add_err_messages(request, e.args[0])
                 else:
-                    add_err_messages(
+                    messages.success(
                         request,
-                        [
-                            str(list(er.values())[0][0])
-                            for er in serializer.errors
-                        ],
+                        f"Добавлено записей: {inserted}, "
+                        f"пропущено существующих: {skipped}",
                     )
+                    return redirect("admin:report_accrual_changelist")
             elif form.is_valid():
-                request.session["uploaded_data"] = AccrualSerializer(
-                    form.cleaned_data["csv_file"], many=True
-                ).data
+                upload = stage_report(
+                    form.cleaned_data["csv_file"],
+                    UploadedReport.ReportType.ACCRUAL,
+                )
                 context["objects"] = form.cleaned_data["csv_file"]
+                context["upload_token"] = upload.token
             else:
                 err = form.errors["csv_file"].as_text()
                 fix_err = err.replace("* [&#x27;", "").replace("&#x27;]", "")
@@ -79,6 +145,10 @@ class AccrualAdmin(admin.ModelAdmin):
         response = super().changelist_view(request, extra_context)
         response.context_data["buttons"] = [
             {"url": "admin:import_accrual_csv", "name": "Загрузить CSV"},
+            {
+                "url": "admin:import_accrual_background",
+                "name": "Загрузить CSV в фоне",
+            },
         ]
         try:
             qs = response.context_data["cl"].queryset
@@ -100,10 +170,11 @@ class AccrualAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
-class SaleAdmin(admin.ModelAdmin):
+class SaleAdmin(BackgroundImportMixin, admin.ModelAdmin):
     """Sale model admin site."""
 
     list_display = ("date", "employee", "name", "sum")
+    report_type = UploadedReport.ReportType.SALE
     list_filter = (DateReportFilter, EmployeeSaleFilter)
     ordering = ("-date",)
 
@@ -121,30 +192,28 @@ class SaleAdmin(admin.ModelAdmin):
         if request.method == "POST":
             form = SaleCsvForm(request.POST, request.FILES)
             if "db_save" in request.POST:
-                data = request.session.get("uploaded_data", [])
-                serializer = SaleSerializer(data=data, many=True)
-                if serializer.is_valid():
-                    try:
-                        serializer.save()
-                    except IntegrityError:
-                        add_err_messages(
-                            request,
-                            [
-                                str(list(er.values()))
-                                for er in serializer.errors
-                            ],
-                        )
-                    return redirect("admin:report_sale_changelist")
+                try:
+                    inserted, skipped = save_uploaded_report(
+                        request.POST.get("upload_token"),
+                        UploadedReport.ReportType.SALE,
+                        ignore_conflicts=True,
+                    )
+                except ParseFail as e:
+                    add_err_messages(request, e.args[0])
                 else:
-                    add_err_messages(
+                    messages.success(
                         request,
-                        [str(list(er.values())) for er in serializer.errors],
+                        f"Добавлено записей: {inserted}, "
+                        f"пропущено существующих: {skipped}",
                     )
+                    return redirect("admin:report_sale_changelist")
             elif form.is_valid():
-                request.session["uploaded_data"] = SaleSerializer(
-                    form.cleaned_data["csv_file"], many=True
-                ).data
+                upload = stage_report(
+                    form.cleaned_data["csv_file"],
+                    UploadedReport.ReportType.SALE,
+                )
                 context["objects"] = form.cleaned_data["csv_file"]
+                context["upload_token"] = upload.token
             else:
                 err = form.errors["csv_file"].as_text()
                 fix_err = err.replace("* [&#x27;", "").replace("&#x27;]", "")
@@ -168,6 +237,10 @@ class SaleAdmin(admin.ModelAdmin):
         extra_context = extra_context or {}
         extra_context["buttons"] = [
             {"url": "admin:import_sale_csv", "name": "Загрузить CSV"},
+            {
+                "url": "admin:import_sale_background",
+                "name": "Загрузить CSV в фоне",
+            },
         ]
         response = super().changelist_view(request, extra_context)
         try:
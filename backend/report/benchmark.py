@@ -0,0 +1,107 @@
+import datetime
+import random
+
+from core.models import Employee
+
+from .constants import date_format, sale_fields, trainer_fields
+
+
+def create_employees(count: int) -> list[Employee]:
+    """Create employees for the synthetic reports."""
+    return Employee.objects.bulk_create(
+        Employee(
+            surname=f"Тестова{number}",
+            name=f"Имя{number}",
+            patronymic="Отчество",
+        )
+        for number in range(count)
+    )
+
+
+def get_report_name(employee: Employee, rand: random.Random) -> str:
+    """Get name as FitBase writes it: full or with initial."""
+    if rand.random() < 0.5:
+        return f"{employee.surname} {employee.name}"
+    return f"{employee.surname} {employee.name[0]}."
+
+
+def make_csv(
+    fields: list[str],
+    make_line,
+    rows: int,
+    duplicate_ratio: float,
+    error_ratio: float,
+    seed: int,
+) -> bytes:
+    """Build report file with repeated and broken lines."""
+    rand = random.Random(seed)
+    lines = []
+    for number in range(rows):
+        if lines and rand.random() < duplicate_ratio:
+            lines.append(rand.choice(lines))
+            continue
+        line = make_line(number, rand)
+        if rand.random() < error_ratio:
+            line[fields[0]] = "ошибка"
+        lines.append(line)
+    return "\n".join(
+        [
+            ";".join(fields),
+            *(
+                ";".join(str(line[field]) for field in fields)
+                for line in lines
+            ),
+        ]
+    ).encode()
+
+
+def make_trainer_csv(
+    employees: list[Employee],
+    rows: int,
+    duplicate_ratio: float = 0,
+    error_ratio: float = 0,
+    seed: int = 0,
+) -> bytes:
+    """Build synthetic trainer report with trainer_fields columns."""
+    start = datetime.datetime(2024, 1, 1, 8)
+
+    def make_line(number, rand):
+        return {
+            "Сумма": rand.choice([500, 700, 1000, 1500]),
+            "Автодействие": rand.choice(["Групповое занятие", "-"]),
+            "Комментарий": f"Занятие {number}",
+            "Сотрудник": get_report_name(rand.choice(employees), rand),
+            "Дата начисления": (
+                start + datetime.timedelta(minutes=number)
+            ).strftime(date_format),
+        }
+
+    return make_csv(
+        trainer_fields, make_line, rows, duplicate_ratio, error_ratio, seed
+    )
+
+
+def make_sale_csv(
+    employees: list[Employee],
+    rows: int,
+    duplicate_ratio: float = 0,
+    error_ratio: float = 0,
+    seed: int = 0,
+) -> bytes:
+    """Build synthetic sale report with sale_fields columns."""
+    start = datetime.datetime(2024, 1, 1, 8)
+
+    def make_line(number, rand):
+        return {
+            "Оплачено,\xa0₽": rand.choice([3000, 5000, 8000]),
+            "Инициатор": get_report_name(rand.choice(employees), rand),
+            "Наименование": "Абонемент",
+            "Дата оплаты": (
+                start + datetime.timedelta(minutes=number)
+            ).strftime(date_format),
+            "Клиент": f"Клиент {number}",
+        }
+
+    return make_csv(
+        sale_fields, make_line, rows, duplicate_ratio, error_ratio, seed
+    )
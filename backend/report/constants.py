@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 sale_fields = [
     "Оплачено,\xa0₽",
     "Инициатор",
@@ -14,3 +16,9 @@ trainer_fields = [
 ]
 
 date_format = "%d.%m.%Y %H:%M"
+
+import_batch_size = 1000
+
+upload_lifetime = timedelta(days=1)
+
+import_job_lifetime = timedelta(days=1)
@@ -1,46 +1,265 @@
-from datetime import datetime
-
 import pandas as pd
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from exceptions import AlreadyExists, ParseFail
-from report.models import Accrual, Sale
-from salary.crud import get_employee_by_name
+from django.db import IntegrityError
+from exceptions import ParseFail
+from pandas.errors import EmptyDataError
+from report.models import Accrual, Sale, UploadedReport
+from report.serializers import AccrualSerializer, SaleSerializer
+from salary.crud import EmployeeResolver
+
+from .constants import (
+    date_format,
+    import_batch_size,
+    sale_fields,
+    trainer_fields,
+)
+
+report_serializers = {
+    UploadedReport.ReportType.ACCRUAL: AccrualSerializer,
+    UploadedReport.ReportType.SALE: SaleSerializer,
+}
+
+
+def get_unique_key(obj) -> tuple:
+    """Get values of the unique_together fields of the report line."""
+    return tuple(
+        getattr(obj, obj._meta.get_field(field).attname)
+        for field in obj._meta.unique_together[0]
+    )
+
+
+def exclude_existing(model, objects: list) -> list:
+    """Drop objects that are already in the database with one query."""
+    if not objects:
+        return []
+    fields = [
+        model._meta.get_field(field).attname
+        for field in model._meta.unique_together[0]
+    ]
+    existing = set(
+        model.objects.filter(
+            date__in={obj.date for obj in objects}
+        ).values_list(*fields)
+    )
+    return [obj for obj in objects if get_unique_key(obj) not in existing]
+
 
-from .constants import date_format, sale_fields, trainer_fields
+def stage_report(objects: list, report_type: str) -> UploadedReport:
+    """Keep parsed lines on the server until the upload is confirmed."""
+    UploadedReport.remove_stale()
+    return UploadedReport.objects.create(
+        report_type=report_type,
+        data=report_serializers[report_type](objects, many=True).data,
+    )
 
 
-def trainer_report_parsing(file) -> list[Accrual]:
+def save_uploaded_report(
+    token, report_type: str, ignore_conflicts: bool = False
+) -> tuple[int, int]:
+    """
+    Check the lines of the confirmed upload in batches and insert them.
+
+    Return the number of inserted and skipped lines. Lines that are already
+    in the database are errors unless ignore_conflicts is set.
+    """
+    try:
+        upload = UploadedReport.objects.filter(
+            token=token, report_type=report_type
+        ).first()
+    except ValidationError:
+        upload = None
+    if upload is None:
+        raise ParseFail(["Загрузка устарела. Загрузите файл заново."])
+    serializer = report_serializers[report_type](
+        data=upload.data,
+        many=True,
+        context={
+            "employee_resolver": EmployeeResolver(),
+            "ignore_conflicts": ignore_conflicts,
+        },
+    )
     try:
-        data = pd.read_csv(filepath_or_buffer=file, sep=";").to_dict("records")
-        if not all(key in data[0].keys() for key in trainer_fields):
-            raise ParseFail("Неизвестный вид отчета. Нет обязательных полей.")
-    except IndexError:
+        if not serializer.is_valid():
+            if isinstance(serializer.errors, dict):
+                raise ParseFail(
+                    [str(e) for e in serializer.errors["non_field_errors"]]
+                )
+            raise ParseFail(
+                [
+                    f"{n} строка: {key}: {value[0]}"
+                    for n, error in enumerate(serializer.errors, start=1)
+                    for key, value in error.items()
+                ]
+            )
+        objects = serializer.save()
+    except IntegrityError:
+        raise ParseFail(
+            ["Часть записей уже добавлена. Загрузите файл заново."]
+        )
+    finally:
+        upload.delete()
+    return len(objects), serializer.skipped
+
+
+def parse_dates(column: pd.Series, errors: list) -> pd.Series:
+    """
+    Parse the date column with date_format in Europe/Moscow.
+
+    Dates stay naive when USE_TZ is off. Lines with a date that can not be
+    parsed are added to errors by line number.
+    """
+    dates = pd.to_datetime(
+        column, format=date_format, errors="coerce"
+    ).dt.tz_localize(settings.TIME_ZONE, ambiguous="NaT", nonexistent="NaT")
+    if not settings.USE_TZ:
+        dates = dates.dt.tz_localize(None)
+    for n, value in column[dates.isna() & column.notna()].items():
+        errors.append(
+            f"{n + 1} строка: {column.name}: Неверная дата {value}, "
+            f"ожидается формат ДД.ММ.ГГГГ ЧЧ:ММ"
+        )
+    return dates
+
+
+def clean_chunk(
+    chunk: pd.DataFrame, sum_field: str, date_field: str, errors: list
+) -> pd.DataFrame:
+    """
+    Normalise the lines of the report column by column.
+
+    Empty cells and "-" become None, sums become numbers and dates are
+    parsed by parse_dates. Lines with a broken date are dropped, other
+    values that can not be converted are left as they are, so model
+    validation reports them for the line.
+    """
+    chunk = chunk.astype(object)
+    chunk = chunk.mask(chunk.isna() | (chunk == "-"), None)
+    sums = pd.to_numeric(chunk[sum_field], errors="coerce")
+    chunk[sum_field] = sums.astype(object).where(
+        sums.notna(), chunk[sum_field]
+    )
+    dates = parse_dates(chunk[date_field], errors)
+    broken = dates.isna() & chunk[date_field].notna()
+    chunk[date_field] = dates.astype(object).where(dates.notna(), None)
+    return chunk[~broken]
+
+
+def read_chunks(
+    file,
+    fields: list[str],
+    sum_field: str,
+    date_field: str,
+    errors: list,
+    progress=None,
+):
+    """
+    Read the report by import_batch_size lines, check the header once.
+
+    Yield lists of (line number, line) for every chunk. When the chunk is
+    processed, progress is called with the number of lines read so far.
+    """
+    try:
+        reader = pd.read_csv(
+            filepath_or_buffer=file, sep=";", chunksize=import_batch_size
+        )
+    except EmptyDataError:
         raise ParseFail("Ошибка в файле.")
-    accruals = []
+    with reader:
+        for number, chunk in enumerate(reader):
+            if number == 0 and not all(key in chunk.columns for key in fields):
+                raise ParseFail(
+                    "Неизвестный вид отчета. Нет обязательных полей."
+                )
+            lines_read = int(chunk.index[-1]) + 1 if len(chunk) else 0
+            chunk = clean_chunk(chunk, sum_field, date_field, errors)
+            yield list(zip(chunk.index + 1, chunk.to_dict("records")))
+            if progress:
+                progress(lines_read)
+
+
+def iter_trainer_report(file, errors: list, resolver=None, progress=None):
+    """Validate the trainer report chunk by chunk and yield new lines."""
+    resolver = resolver or EmployeeResolver()
+    seen = set()
+    for data in read_chunks(
+        file,
+        trainer_fields,
+        sum_field="Сумма",
+        date_field="Дата начисления",
+        errors=errors,
+        progress=progress,
+    ):
+        batch = []
+        for n, line in data:
+            try:
+                sum, name, base, person, date = [
+                    line[field] for field in trainer_fields
+                ]
+                employee = resolver.get(person)
+                line = Accrual(
+                    employee=employee,
+                    sum=sum,
+                    name=name,
+                    date=date,
+                    base=base,
+                )
+                line.clean_fields(exclude=["employee"])
+            except ValidationError as e:
+                for key, value in e.message_dict.items():
+                    errors.append(f"{n} строка: {key}: {value[0]}")
+            except ObjectDoesNotExist as e:
+                errors.append(f"{n} строка: {e}")
+            else:
+                key = get_unique_key(line)
+                if key not in seen:
+                    seen.add(key)
+                    batch.append(line)
+        yield from exclude_existing(Accrual, batch)
+
+
+def iter_sale_report(file, errors: list, resolver=None, progress=None):
+    """Validate the sale report chunk by chunk and yield new lines."""
+    resolver = resolver or EmployeeResolver()
+    seen = set()
+    for data in read_chunks(
+        file,
+        sale_fields,
+        sum_field="Оплачено,\xa0₽",
+        date_field="Дата оплаты",
+        errors=errors,
+        progress=progress,
+    ):
+        batch = []
+        for n, line in data:
+            try:
+                sum, person, name, date, client = [
+                    line[field] for field in sale_fields
+                ]
+                employee = resolver.get(person)
+                line = Sale(
+                    employee=employee,
+                    sum=sum,
+                    name=name,
+                    client=client,
+                    date=date,
+                )
+                line.clean_fields(exclude=["employee"])
+            except ValidationError:
+                continue
+            except ObjectDoesNotExist as e:
+                errors.append(f"{n} строка: {e}")
+            else:
+                key = get_unique_key(line)
+                if key not in seen:
+                    seen.add(key)
+                    batch.append(line)
+        yield from exclude_existing(Sale, batch)
+
+
+def trainer_report_parsing(file, resolver=None) -> list[Accrual]:
     errors = []
-    for n, line in zip(range(1, len(data) + 1), data):
-        try:
-            sum, name, base, person, date = [
-                line[field] for field in trainer_fields
-            ]
-            employee = get_employee_by_name(person)
-            line = Accrual(
-                employee=employee,
-                sum=sum,
-                name=name,
-                date=datetime.strptime(date, date_format),
-                base=base,
-            )
-            line.full_clean()
-        except AlreadyExists:
-            continue
-        except ValidationError as e:
-            for key, value in e.message_dict.items():
-                errors.append(f"{n} строка: {key}: {value[0]}")
-        except ObjectDoesNotExist as e:
-            errors.append(f"{n} строка: {e}")
-        else:
-            accruals.append(line)
+    accruals = list(iter_trainer_report(file, errors, resolver))
     if errors:
         raise ParseFail(errors)
     if not accruals:
@@ -48,32 +267,9 @@ def trainer_report_parsing(file) -> list[Accrual]:
     return accruals
 
 
-def sale_report_parsing(file) -> list[Accrual]:
-    data = pd.read_csv(filepath_or_buffer=file, sep=";").to_dict("records")
-    if not all(key in data[0].keys() for key in sale_fields):
-        raise ParseFail("Неизвестный вид отчета. Нет обязательных полей.")
-    accruals = []
+def sale_report_parsing(file, resolver=None) -> list[Sale]:
     errors = []
-    for n, line in zip(range(1, len(data) + 1), data):
-        try:
-            sum, person, name, date, client = [
-                line[field] for field in sale_fields
-            ]
-            employee = get_employee_by_name(person)
-            line = Sale(
-                employee=employee,
-                sum=sum,
-                name=name,
-                client=client,
-                date=datetime.strptime(date, date_format),
-            )
-            line.full_clean()
-        except (AlreadyExists, ValidationError):
-            continue
-        except ObjectDoesNotExist as e:
-            errors.append(f"{n} строка: {e}")
-        else:
-            accruals.append(line)
+    accruals = list(iter_sale_report(file, errors, resolver))
     if errors:
         raise ParseFail(errors)
     if not accruals:
@@ -34,3 +34,9 @@ class SaleCsvForm(forms.Form):
             raise ValidationError(e)
 
         return objects
+
+
+class BackgroundCsvForm(forms.Form):
+    """CSV receive form for the background import."""
+
+    csv_file = forms.FileField(required=True, label="Выберете файл")
@@ -0,0 +1,139 @@
+import io
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from exceptions import ParseFail
+from redis import Redis
+from salary.crud import EmployeeResolver
+
+from .constants import import_batch_size, import_job_lifetime
+from .file_parse import iter_sale_report, iter_trainer_report
+from .models import Accrual, Sale, UploadedReport
+
+queue_key = "report_import:queue"
+
+report_importers = {
+    UploadedReport.ReportType.ACCRUAL: (Accrual, iter_trainer_report),
+    UploadedReport.ReportType.SALE: (Sale, iter_sale_report),
+}
+
+
+def get_redis(decode_responses: bool = True) -> Redis:
+    return Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        decode_responses=decode_responses,
+    )
+
+
+def get_job_key(job_id: str) -> str:
+    return f"report_import:{job_id}"
+
+
+def submit_import(file, report_type: str) -> str:
+    """Put the uploaded report in the queue of the import worker."""
+    redis = get_redis(decode_responses=False)
+    job_id = uuid.uuid4().hex
+    key = get_job_key(job_id)
+    content = file.read()
+    with redis.pipeline() as pipe:
+        pipe.set(f"{key}:file", content, ex=import_job_lifetime)
+        pipe.hset(
+            key,
+            mapping={
+                "report_type": report_type,
+                "status": "queued",
+                "total": content.rstrip(b"\n").count(b"\n"),
+                "processed": 0,
+                "inserted": 0,
+                "errors": "[]",
+            },
+        )
+        pipe.expire(key, import_job_lifetime)
+        pipe.rpush(queue_key, job_id)
+        pipe.execute()
+    return job_id
+
+
+def get_progress(job_id: str) -> dict | None:
+    """Get state of the import with ETA in seconds."""
+    job = get_redis().hgetall(get_job_key(job_id))
+    if not job:
+        return None
+    processed = int(job["processed"])
+    total = max(int(job["total"]), processed)
+    eta = None
+    if job["status"] == "running" and processed:
+        elapsed = time.time() - float(job["started"])
+        eta = round(elapsed / processed * (total - processed))
+    return {
+        "status": job["status"],
+        "total": total,
+        "processed": processed,
+        "inserted": int(job["inserted"]),
+        "errors": json.loads(job["errors"]),
+        "eta": eta,
+    }
+
+
+def run_import(job_id: str) -> None:
+    """
+    Parse, check and save the queued report.
+
+    Everything is saved in one transaction, so a report with errors leaves
+    the database unchanged, like the upload in the admin does.
+    """
+    redis = get_redis()
+    key = get_job_key(job_id)
+    content = get_redis(decode_responses=False).get(f"{key}:file")
+    report_type = redis.hget(key, "report_type")
+    if content is None or report_type is None:
+        return
+    model, importer = report_importers[report_type]
+    redis.hset(key, mapping={"status": "running", "started": time.time()})
+    errors = []
+    inserted = 0
+
+    def progress(processed):
+        redis.hset(
+            key,
+            mapping={
+                "processed": processed,
+                "errors": json.dumps(errors, ensure_ascii=False),
+            },
+        )
+
+    try:
+        with transaction.atomic():
+            batch = []
+            for obj in importer(
+                io.BytesIO(content), errors, EmployeeResolver(), progress
+            ):
+                batch.append(obj)
+                if len(batch) == import_batch_size:
+                    model.objects.bulk_create(batch, ignore_conflicts=True)
+                    inserted += len(batch)
+                    batch = []
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            inserted += len(batch)
+            if errors:
+                transaction.set_rollback(True)
+    except ParseFail as e:
+        errors.append(str(e))
+    if errors:
+        status = "failed"
+        inserted = 0
+    else:
+        status = "done"
+    redis.hset(
+        key,
+        mapping={
+            "status": status,
+            "inserted": inserted,
+            "errors": json.dumps(errors, ensure_ascii=False),
+        },
+    )
+    redis.delete(f"{key}:file")
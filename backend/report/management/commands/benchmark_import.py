@@ -0,0 +1,112 @@
+import io
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from exceptions import ParseFail
+from report.benchmark import create_employees, make_sale_csv, make_trainer_csv
+from report.file_parse import (
+    sale_report_parsing,
+    save_uploaded_report,
+    stage_report,
+    trainer_report_parsing,
+)
+from report.models import UploadedReport
+
+
+class Command(BaseCommand):
+    """Measure report import on synthetic FitBase files."""
+
+    help = (
+        "Measure report import on synthetic FitBase files. "
+        "All created rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        """Add generator options."""
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--employees", type=int, default=30)
+        parser.add_argument("--duplicate-ratio", type=float, default=0.05)
+        parser.add_argument("--error-ratio", type=float, default=0)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def run(self, func, prepare) -> tuple:
+        """Run func on the result of prepare, return result, time, queries."""
+        argument = prepare()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                result = func(argument)
+            except ParseFail as e:
+                result = e
+        return result, time.perf_counter() - start, len(queries)
+
+    def measure(self, name: str, rows: int, func, prepare=lambda: None):
+        """
+        Run func and print rows/sec and query count, then run it traced.
+
+        The timed run is rolled back, so the run traced for peak memory
+        gets the same data. prepare is not measured, func gets its result.
+        """
+        with transaction.atomic():
+            result, duration, queries = self.run(func, prepare)
+            transaction.set_rollback(True)
+        tracemalloc.start()
+        self.run(func, prepare)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if isinstance(result, ParseFail):
+            self.stdout.write(f"{name}: {len(result.args[0])} errors")
+            result = None
+        self.stdout.write(
+            f"{name}: {rows} rows in {duration:.2f} s, "
+            f"{rows / duration:.0f} rows/s, "
+            f"{queries} queries, "
+            f"peak memory {peak / 2**20:.1f} MB"
+        )
+        return result
+
+    def handle(self, *args, **options):
+        """Benchmark launch point."""
+        rows = options["rows"]
+        generator_options = {
+            "rows": rows,
+            "duplicate_ratio": options["duplicate_ratio"],
+            "error_ratio": options["error_ratio"],
+            "seed": options["seed"],
+        }
+        with transaction.atomic():
+            employees = create_employees(options["employees"])
+            for name, make, parse, report_type in (
+                (
+                    "trainer",
+                    make_trainer_csv,
+                    trainer_report_parsing,
+                    UploadedReport.ReportType.ACCRUAL,
+                ),
+                (
+                    "sale",
+                    make_sale_csv,
+                    sale_report_parsing,
+                    UploadedReport.ReportType.SALE,
+                ),
+            ):
+                content = make(employees, **generator_options)
+                objects = self.measure(
+                    f"{name} parsing",
+                    rows,
+                    lambda _: parse(io.BytesIO(content)),
+                )
+                if not objects:
+                    continue
+                self.measure(
+                    f"{name} serializer save",
+                    len(objects),
+                    lambda upload: save_uploaded_report(
+                        upload.token, report_type
+                    ),
+                    lambda: stage_report(objects, report_type),
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from report.jobs import get_job_key, get_redis, queue_key, run_import
+
+from backend.settings import logger
+
+
+class Command(BaseCommand):
+    """Run report imports submitted from the admin site."""
+
+    help = "Run report imports submitted from the admin site."
+
+    def handle(self, *args, **kwargs):
+        """Worker launch point."""
+        redis = get_redis()
+        while True:
+            _, job_id = redis.blpop(queue_key)
+            logger.info(f"Report import {job_id} started")
+            # Drop broken and expired connections like Django does around
+            # every request, the worker lives longer than any of them.
+            close_old_connections()
+            try:
+                run_import(job_id)
+            except Exception as e:
+                logger.exception(f"Report import {job_id} failed")
+                redis.hset(
+                    get_job_key(job_id),
+                    mapping={
+                        "status": "failed",
+                        "errors": json.dumps([str(e)], ensure_ascii=False),
+                    },
+                )
+            else:
+                logger.info(f"Report import {job_id} finished")
+            finally:
+                close_old_connections()
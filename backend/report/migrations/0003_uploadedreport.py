@@ -0,0 +1,64 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:18
+
+import datetime
+import uuid
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("report", "0002_alter_accrual_employee_alter_sale_employee"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadedReport",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "token",
+                    models.UUIDField(
+                        default=uuid.uuid4, unique=True, verbose_name="Токен"
+                    ),
+                ),
+                (
+                    "report_type",
+                    models.CharField(
+                        choices=[
+                            ("accrual", "Начисления"),
+                            ("sale", "Продажи"),
+                        ],
+                        verbose_name="Вид отчёта",
+                    ),
+                ),
+                (
+                    "data",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        verbose_name="Строки",
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateTimeField(
+                        default=datetime.datetime.today,
+                        verbose_name="Дата загрузки",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "загруженный отчёт",
+                "verbose_name_plural": "загруженные отчёты",
+            },
+        ),
+    ]
@@ -1,7 +1,13 @@
+import datetime
+import uuid
+
 from core.models import Employee
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from exceptions import AlreadyExists
 
+from .constants import upload_lifetime
+
 
 class Accrual(models.Model):
     """Accrual from FitBase."""
@@ -27,14 +33,6 @@ class Accrual(models.Model):
     base = models.CharField("Основание", blank=True, null=True)
     sum = models.FloatField("Сумма")
 
-    def __init__(self, *args, **kwargs):
-        """Init method. Added correction for empty lines."""
-        super().__init__(*args, **kwargs)
-        for field in self._meta.get_fields():
-            value = getattr(self, field.attname)
-            if str(value) == "nan" or value == "-":
-                setattr(self, field.attname, None)
-
     def __str__(self):
         return " ".join(
             map(
@@ -117,3 +115,36 @@ class Sale(models.Model):
             ).exists()
         ):
             raise AlreadyExists("Запись уже существует")
+
+
+class UploadedReport(models.Model):
+    """Parsed report waiting for confirmation."""
+
+    class Meta:
+        """UploadedReport metaclass."""
+
+        verbose_name = "загруженный отчёт"
+        verbose_name_plural = "загруженные отчёты"
+
+    class ReportType(models.TextChoices):
+        """Types of report."""
+
+        ACCRUAL = "accrual", "Начисления"
+        SALE = "sale", "Продажи"
+
+    token = models.UUIDField("Токен", default=uuid.uuid4, unique=True)
+    report_type = models.CharField("Вид отчёта", choices=ReportType.choices)
+    data = models.JSONField("Строки", encoder=DjangoJSONEncoder)
+    date = models.DateTimeField(
+        "Дата загрузки", default=datetime.datetime.today
+    )
+
+    def __str__(self):
+        return f"{self.get_report_type_display()} {self.date}"
+
+    @classmethod
+    def remove_stale(cls):
+        """Remove uploads older than upload_lifetime."""
+        cls.objects.filter(
+            date__lt=datetime.datetime.today() - upload_lifetime
+        ).delete()
@@ -1,19 +1,109 @@
+from core.models import Employee
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from rest_framework import serializers
 
+from .constants import import_batch_size
 from .models import Accrual, Sale
 
 
+class EmployeeField(serializers.PrimaryKeyRelatedField):
+    """Employee field answered by the EmployeeResolver from the context."""
+
+    def to_internal_value(self, data):
+        """Get employee from the resolver instead of a query per line."""
+        resolver = self.context.get("employee_resolver")
+        if resolver is None:
+            return super().to_internal_value(data)
+        try:
+            return resolver.get_by_id(data)
+        except ObjectDoesNotExist:
+            self.fail("does_not_exist", pk_value=data)
+
+
+class ReportListSerializer(serializers.ListSerializer):
+    """
+    Check and save report lines in batches instead of line by line.
+
+    With ignore_conflicts in the context existing lines are skipped instead
+    of raising errors and the insert ignores unique_together conflicts.
+    """
+
+    skipped = 0
+
+    def get_key(self, data) -> tuple:
+        """Get values of the unique_together fields of the line."""
+        values = (
+            data.get(field)
+            for field in self.child.Meta.model._meta.unique_together[0]
+        )
+        return tuple(getattr(value, "pk", value) for value in values)
+
+    def validate(self, attrs):
+        """Check the existence of the lines with one query per batch."""
+        attrs = super().validate(attrs)
+        model = self.child.Meta.model
+        fields = [
+            model._meta.get_field(field).attname
+            for field in model._meta.unique_together[0]
+        ]
+        ignore_conflicts = self.context.get("ignore_conflicts", False)
+        errors = []
+        new = []
+        seen = set()
+        for start in range(0, len(attrs), import_batch_size):
+            end = start + import_batch_size
+            batch = attrs[start:end]
+            existing = set(
+                model.objects.filter(
+                    date__in={data["date"] for data in batch}
+                ).values_list(*fields)
+            )
+            for data in batch:
+                key = self.get_key(data)
+                if key in existing or key in seen:
+                    if not ignore_conflicts:
+                        errors.append(
+                            f"Запись {str(model(**data))} уже существует!"
+                        )
+                    continue
+                seen.add(key)
+                new.append(data)
+        if errors:
+            raise serializers.ValidationError(errors)
+        self.skipped = len(attrs) - len(new)
+        return new
+
+    def create(self, validated_data):
+        """Insert all lines with batched writes."""
+        model = self.child.Meta.model
+        with transaction.atomic():
+            return model.objects.bulk_create(
+                [model(**data) for data in validated_data],
+                batch_size=import_batch_size,
+                ignore_conflicts=self.context.get("ignore_conflicts", False),
+            )
+
+
 class AccrualSerializer(serializers.ModelSerializer):
     """Accrual serializer."""
 
+    employee = EmployeeField(
+        queryset=Employee.objects.all(), allow_null=True, required=False
+    )
+
     class Meta:
         """Meta class."""
 
         model = Accrual
         fields = "__all__"
+        list_serializer_class = ReportListSerializer
+        validators = []
 
     def validate(self, data):
         """Check the existence of such a record."""
+        if isinstance(self.parent, ReportListSerializer):
+            return data
         obj = Accrual.objects.filter(**data).first()
         if obj:
             raise serializers.ValidationError(
@@ -25,15 +115,23 @@ class AccrualSerializer(serializers.ModelSerializer):
 class SaleSerializer(serializers.ModelSerializer):
     """Sale serializer."""
 
+    employee = EmployeeField(
+        queryset=Employee.objects.all(), allow_null=True, required=False
+    )
+
     class Meta:
         """Meta class."""
 
         model = Sale
         fields = "__all__"
+        list_serializer_class = ReportListSerializer
+        validators = []
 
     def validate(self, data):
         """Check the existence of such a record."""
         data = super().validate(data)
+        if isinstance(self.parent, ReportListSerializer):
+            return data
         obj = Sale.objects.filter(**data).first()
         if obj:
             raise serializers.ValidationError(
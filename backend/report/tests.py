@@ -0,0 +1,136 @@
+import datetime
+import io
+
+from django.test import TestCase
+from exceptions import ParseFail
+
+from .benchmark import create_employees
+from .constants import trainer_fields
+from .file_parse import (
+    save_uploaded_report,
+    stage_report,
+    trainer_report_parsing,
+)
+from .models import Accrual, UploadedReport
+
+
+def make_report(lines: list[tuple]) -> io.BytesIO:
+    """Build trainer report file of the lines."""
+    return io.BytesIO(
+        "\n".join(
+            ";".join(map(str, line)) for line in [trainer_fields, *lines]
+        ).encode()
+    )
+
+
+class TrainerReportTest(TestCase):
+    """Trainer report lines are checked, deduplicated and saved."""
+
+    def setUp(self):
+        """Create employees of the report."""
+        self.employee, self.other = create_employees(2)
+
+    def get_line(self, minute: int, sum=500, name="Тестова0 Имя0") -> tuple:
+        """Get report line of the employee at the minute of 01.01.2024."""
+        return (
+            sum,
+            "-",
+            f"Занятие {minute}",
+            name,
+            f"01.01.2024 08:{minute:02}",
+        )
+
+    def add_accrual(self, minute: int) -> Accrual:
+        """Store accrual equal to the report line of the minute."""
+        return Accrual.objects.create(
+            employee=self.employee,
+            sum=500,
+            name=None,
+            base=f"Занятие {minute}",
+            date=datetime.datetime(2024, 1, 1, 8, minute),
+        )
+
+    def test_line_errors(self):
+        """Report errors with the line number."""
+        with self.assertRaises(ParseFail) as error:
+            trainer_report_parsing(
+                make_report(
+                    [
+                        self.get_line(1),
+                        self.get_line(2, name="Неизвестный Иван"),
+                        self.get_line(3, sum="ошибка"),
+                    ]
+                )
+            )
+        errors = error.exception.args[0]
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(
+            errors[0], "2 строка: Сотрудник Неизвестный Иван не добавлен!"
+        )
+        self.assertTrue(errors[1].startswith("3 строка: sum: "))
+
+    def test_bad_date(self):
+        """Flag lines with a broken date by line number."""
+        broken = (500, "-", "Занятие", "Тестова0 Имя0", "32.01.2024 08:00")
+        with self.assertRaises(ParseFail) as error:
+            trainer_report_parsing(
+                make_report([self.get_line(1), broken, self.get_line(3)])
+            )
+        self.assertEqual(
+            error.exception.args[0],
+            [
+                "2 строка: Дата начисления: Неверная дата 32.01.2024 08:00, "
+                "ожидается формат ДД.ММ.ГГГГ ЧЧ:ММ"
+            ],
+        )
+
+    def test_skip_existing_and_duplicates(self):
+        """Skip lines stored before and repeated in the file."""
+        self.add_accrual(1)
+        accruals = trainer_report_parsing(
+            make_report(
+                [
+                    self.get_line(1),
+                    self.get_line(2),
+                    self.get_line(2),
+                    self.get_line(3, name="Тестова1 И."),
+                ]
+            )
+        )
+        self.assertEqual(
+            [(accrual.base, accrual.employee) for accrual in accruals],
+            [("Занятие 2", self.employee), ("Занятие 3", self.other)],
+        )
+        self.assertEqual(accruals[0].name, None)
+
+    def test_save_uploaded_report(self):
+        """Insert new lines of the confirmed upload and count skipped."""
+        accruals = trainer_report_parsing(
+            make_report([self.get_line(minute) for minute in range(1, 4)])
+        )
+        upload = stage_report(accruals, UploadedReport.ReportType.ACCRUAL)
+        self.add_accrual(2)
+        self.assertEqual(
+            save_uploaded_report(
+                upload.token,
+                UploadedReport.ReportType.ACCRUAL,
+                ignore_conflicts=True,
+            ),
+            (2, 1),
+        )
+        self.assertEqual(Accrual.objects.count(), 3)
+        self.assertFalse(UploadedReport.objects.exists())
+
+    def test_save_uploaded_report_conflict(self):
+        """Report lines stored after the upload without ignore_conflicts."""
+        upload = stage_report(
+            trainer_report_parsing(make_report([self.get_line(1)])),
+            UploadedReport.ReportType.ACCRUAL,
+        )
+        self.add_accrual(1)
+        with self.assertRaises(ParseFail) as error:
+            save_uploaded_report(
+                upload.token, UploadedReport.ReportType.ACCRUAL
+            )
+        self.assertIn("уже существует", error.exception.args[0][0])
+        self.assertEqual(Accrual.objects.count(), 1)
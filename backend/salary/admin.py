@@ -3,20 +3,29 @@ import datetime
 from constants import months
 from core.models import Employee
 from django.contrib import admin, messages
-from django.core.exceptions import FieldError
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.template.response import TemplateResponse
 from django.urls import path
+from django.utils.http import content_disposition_header
 from utils import (
     add_err_messages,
     format_money,
     last_day_of_the_previous_month,
 )
 
-from .crud import create_documents_for_last_month, create_pdf
+from .crud import (
+    calculate_certificates,
+    check_templates,
+    create_documents_for_last_month,
+    get_certificates_pdf,
+    iter_certificates_zip,
+    iter_contracts_zip,
+)
 from .filters import SalaryCertificateDateFilter
+from .forms import ContractTemplateForm
 from .models import (
     AmountOfAccrual,
     Contract,
@@ -26,6 +35,7 @@ from .models import (
     PercentageOfSales,
     Rate,
     SalaryCertificate,
+    set_new_numbers,
 )
 from .serializers import SalaryCertificateSerializer
 
@@ -52,7 +62,14 @@ class FieldInLine(admin.TabularInline):
 class SalaryCertificateAdmin(admin.ModelAdmin):
     """SalaryCertificate model admin site."""
 
-    actions = ("download_document", "recalculate_data", "lock", "unlock")
+    actions = (
+        "download_document",
+        "download_archive",
+        "recalculate_data",
+        "preview_recalculation",
+        "lock",
+        "unlock",
+    )
     fields = (
         "number",
         "contract",
@@ -81,13 +98,27 @@ class SalaryCertificateAdmin(admin.ModelAdmin):
 
     inlines = (FieldInLine,)
 
+    def get_queryset(self, request):
+        """Load contract, employee and template with the certificates."""
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("contract__employee", "contract__template")
+        )
+
     def create_multiple(self, request):
         """Add certificate."""
         if request.method == "POST":
             data = request.session.get("uploaded_data", [])
             serializer = SalaryCertificateSerializer(data=data, many=True)
             if serializer.is_valid():
-                serializer.save()
+                docs = [
+                    SalaryCertificate(**data)
+                    for data in serializer.validated_data
+                ]
+                with transaction.atomic():
+                    set_new_numbers(docs)
+                    SalaryCertificate.objects.bulk_create(docs)
                 messages.success(request, "Записи добавлены!")
             else:
                 add_err_messages(
@@ -124,9 +155,7 @@ class SalaryCertificateAdmin(admin.ModelAdmin):
         ]
         try:
             qs = response.context_data["cl"].queryset
-            total = qs.annotate(
-                sum=F("field__price") * F("field__count")
-            ).aggregate(Sum("sum"))["sum__sum"]
+            total = qs.aggregate(Sum("total"))["total__sum"]
         except (AttributeError, KeyError):
             pass
         else:
@@ -148,22 +177,63 @@ class SalaryCertificateAdmin(admin.ModelAdmin):
     @admin.action(description="📥 Скачать документ")
     def download_document(self, request, queryset):
         """Download document."""
-        file = create_pdf(queryset)
+        file = get_certificates_pdf(queryset)
+        file_name = datetime.datetime.today().strftime("%d.%m.%Y %H:%M")
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename=f"{file_name}.pdf",
+            content_type="application/x-pdf",
+        )
+
+    @admin.action(description="🗂 Скачать архив по сотрудникам")
+    def download_archive(self, request, queryset):
+        """Download ZIP archive with a document for every employee."""
         file_name = datetime.datetime.today().strftime("%d.%m.%Y %H:%M")
-        response = HttpResponse(file.read(), content_type="application/x-pdf")
-        response[
-            "Content-Disposition"
-        ] = f'attachment\x3B filename="{file_name}.pdf"'
+        response = StreamingHttpResponse(
+            iter_certificates_zip(queryset), content_type="application/zip"
+        )
+        response["Content-Disposition"] = content_disposition_header(
+            True, f"{file_name}.zip"
+        )
         return response
 
     @admin.action(description="♻️ Пересчитать")
     def recalculate_data(self, request, queryset: list[SalaryCertificate]):
         """Recalculate automatic fields according to the contract rules."""
-        for item in queryset:
-            try:
-                item.calculate()
-            except FieldError as e:
-                messages.error(request, f"{item.__str__()}: {e}")
+        changes, errors = calculate_certificates(
+            queryset.select_related("contract__employee")
+        )
+        created, updated, deleted = map(len, changes)
+        messages.success(
+            request,
+            f"Добавлено строк: {created}, изменено: {updated}, "
+            f"удалено: {deleted}",
+        )
+        add_err_messages(request, errors)
+
+    @admin.action(description="👁 Предпросмотр пересчёта")
+    def preview_recalculation(
+        self, request, queryset: list[SalaryCertificate]
+    ):
+        """Show changes of automatic fields without saving them."""
+        certificates = queryset.select_related("contract__employee")
+        changes, errors = calculate_certificates(certificates, preview=True)
+        lines = {}
+        for sign, fields in zip("+~-", changes):
+            for field in fields:
+                lines.setdefault(field.salary_certificate_id, []).append(
+                    f"{sign} {field}"
+                )
+        for certificate in certificates:
+            if certificate.id in lines:
+                messages.info(
+                    request,
+                    f"{certificate}: {'; '.join(lines[certificate.id])}",
+                )
+        if not lines:
+            messages.info(request, "Изменений нет")
+        add_err_messages(request, errors)
 
     @admin.action(description="🔐 Заблокировать")
     def lock(self, request, queryset: list[SalaryCertificate]):
@@ -189,9 +259,45 @@ class ContractAdmin(admin.ModelAdmin):
         "original_signed",
         "is_active",
     )
+    actions = ("download_contracts",)
     list_filter = ("template", "original_signed")
     ordering = ("-number",)
 
+    def get_queryset(self, request):
+        """Load employee and template with the contracts."""
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("employee", "template")
+        )
+
+    @admin.action(description="📄 Сформировать договоры")
+    def download_contracts(self, request, queryset):
+        """Download ZIP archive of contracts filled from their templates."""
+        without_file = queryset.filter(
+            Q(template__file="") | Q(template__file=None)
+        )
+        for contract in without_file:
+            messages.warning(request, f"{contract}: у шаблона нет файла")
+        contracts = queryset.exclude(pk__in=without_file)
+        errors = check_templates(
+            ContractTemplate.objects.filter(
+                id__in=contracts.values("template_id")
+            )
+        )
+        add_err_messages(request, errors.values())
+        contracts = contracts.exclude(template_id__in=list(errors))
+        if not contracts.exists():
+            return None
+        file_name = datetime.datetime.today().strftime("%d.%m.%Y %H:%M")
+        response = StreamingHttpResponse(
+            iter_contracts_zip(contracts), content_type="application/zip"
+        )
+        response["Content-Disposition"] = content_disposition_header(
+            True, f"Договоры {file_name}.zip"
+        )
+        return response
+
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         """Only administrators can be on the schedule."""
         if db_field.name == "employee":
@@ -231,6 +337,7 @@ class ContractTemplateAdmin(admin.ModelAdmin):
     """ContractTemplate model admin site."""
 
     list_display = ("name", "is_active")
+    form = ContractTemplateForm
 
     inlines = (
         AmountOfAccrualInLine,
@@ -239,14 +346,6 @@ class ContractTemplateAdmin(admin.ModelAdmin):
         HourlyPaymentInLine,
     )
 
-    def save_model(self, request, obj, form, change):
-        """Save bytes to the database."""
-        if form.is_valid() and form.cleaned_data["file"]:
-            uploaded_img = form.save(commit=False)
-            uploaded_img.file_data = form.cleaned_data["file"].file.read()
-            uploaded_img.save()
-        super().save_model(request, obj, form, change)
-
 
 admin.site.register(SalaryCertificate, SalaryCertificateAdmin)
 admin.site.register(Contract, ContractAdmin)
@@ -0,0 +1,58 @@
+import datetime
+
+from core.models import Employee
+from report.benchmark import create_employees
+
+from .models import (
+    Contract,
+    ContractTemplate,
+    Field,
+    SalaryCertificate,
+    update_totals,
+)
+
+
+def create_certificates(
+    count: int, lines: int
+) -> tuple[list[SalaryCertificate], Employee]:
+    """Create certificates with the given number of fields and an owner."""
+    employees = create_employees(count)
+    owner = employees[0]
+    owner.is_owner = True
+    owner.save(update_fields=["is_owner"])
+    template = ContractTemplate.objects.create(name="Тестовый шаблон")
+    contracts = Contract.objects.bulk_create(
+        Contract(
+            employee=employee,
+            template=template,
+            number=number,
+            start_date=datetime.date(2024, 1, 1),
+        )
+        for number, employee in enumerate(employees, start=1_000_000)
+    )
+    certificates = SalaryCertificate.objects.bulk_create(
+        SalaryCertificate(
+            contract=contract,
+            number=contract.number,
+            start_date=datetime.date(2024, 1, 1),
+            end_date=datetime.date(2024, 1, 31),
+        )
+        for contract in contracts
+    )
+    Field.objects.bulk_create(
+        Field(
+            salary_certificate=certificate,
+            name=f"Групповое занятие {line}",
+            price=500 + line * 10,
+            count=line % 7 + 0.5,
+        )
+        for certificate in certificates
+        for line in range(lines)
+    )
+    update_totals([certificate.id for certificate in certificates])
+    certificates = list(
+        SalaryCertificate.objects.filter(
+            id__in=[certificate.id for certificate in certificates]
+        ).select_related("contract__employee")
+    )
+    return certificates, owner
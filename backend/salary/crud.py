@@ -1,78 +1,483 @@
 import io
+import itertools
+import multiprocessing
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from borb.pdf import PDF, Document
 from constants import non_employees_list
-from core.models import Employee
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db.models import Q
-from salary.make_pdf import create_list
+from core.models import Employee, Schedule
+from django.conf import settings
+from django.core.exceptions import (
+    FieldError,
+    ObjectDoesNotExist,
+    ValidationError,
+)
+from django.db import connections
+from django.db.models import Count, F, Q, Sum, prefetch_related_objects
+from django.db.models.functions import TruncDate
+from exceptions import TemplateFail
+from report.models import Accrual, Sale
+from salary.make_contract import (
+    compile_template,
+    create_contract,
+    get_contract_file_name,
+)
+from salary.make_pdf import dump_page, get_page_key, get_renderer, load_page
 from utils import (
     first_day_of_the_previous_month,
     last_day_of_the_previous_month,
 )
 
 from .models import (
+    CertificateIntervals,
     Contract,
+    RenderedDocument,
     SalaryCertificate,
-    get_new_salary_certificate_number,
+    apply_auto_field_changes,
+    get_accrual_full_name,
+    get_auto_field_changes,
+    get_templates_with_rules,
 )
 
+pdf_chunk_size = 10
 
-def create_pdf(сertificates) -> io.BytesIO:
-    doc = Document()
+
+def get_process_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """Get pool of forked processes for rendering documents."""
+    # Forked workers must not share the connection of the parent.
+    connections.close_all()
+    return ProcessPoolExecutor(
+        max_workers=workers or settings.PDF_WORKERS,
+        mp_context=multiprocessing.get_context("fork"),
+    )
+
+
+def get_chunks(ids: list[int]) -> list[list[int]]:
+    chunks = []
+    for start in range(0, len(ids), pdf_chunk_size):
+        end = start + pdf_chunk_size
+        chunks.append(ids[start:end])
+    return chunks
+
+
+def use_pool(size: int) -> bool:
+    """Check if size documents are rendered in a process pool."""
+    return settings.PDF_WORKERS > 1 and size > pdf_chunk_size
+
+
+def map_chunks(func, ids: list[int]):
+    """Yield results of func for chunks of ids, in a pool if use_pool."""
+    if not use_pool(len(ids)):
+        yield from map(func, get_chunks(ids))
+        return
+    with get_process_pool() as pool:
+        yield from pool.map(func, get_chunks(ids))
+
+
+def render_pages(ids: list[int]) -> list[bytes]:
+    """Draw pages of the certificates in the order of ids, dumped."""
+    certificates = SalaryCertificate.objects.select_related(
+        "contract__employee"
+    ).in_bulk(ids)
     owner = Employee.objects.filter(is_owner=True).first()
-    for certificate in сertificates:
-        page = create_list(certificate, owner)
-        doc.add_page(page)
+    create_list = get_renderer()
+    return [dump_page(create_list(certificates[id], owner)) for id in ids]
+
+
+def draw_pages(certificates, owner):
+    """
+    Yield dumped pages of the certificates in order as they are drawn.
+
+    Large selections are drawn by chunks in a pool, see use_pool.
+    """
+    if not use_pool(len(certificates)):
+        create_list = get_renderer()
+        for certificate in certificates:
+            yield dump_page(create_list(certificate, owner))
+        return
+    for pages in map_chunks(
+        render_pages, [certificate.id for certificate in certificates]
+    ):
+        yield from pages
+
+
+def iter_certificate_pages(certificates):
+    """
+    Yield pages of the certificates in order, cached or drawn.
+
+    Signed and blocked certificates can not change, so their pages are
+    cached by get_page_key. Only pages missing in the cache are drawn.
+    """
+    certificates = list(certificates)
+    owner = Employee.objects.filter(is_owner=True).first()
+    fixed = [
+        certificate
+        for certificate in certificates
+        if certificate.is_blocked or certificate.original_signed
+    ]
+    prefetch_related_objects(fixed, "field")
+    keys = {
+        certificate.id: get_page_key(certificate, owner)
+        for certificate in fixed
+    }
+    cached = RenderedDocument.get_files(keys.values())
+    drawn = draw_pages(
+        [
+            certificate
+            for certificate in certificates
+            if keys.get(certificate.id) not in cached
+        ],
+        owner,
+    )
+    new = {}
+    for certificate in certificates:
+        key = keys.get(certificate.id)
+        if key in cached:
+            yield load_page(cached[key])
+            continue
+        page = next(drawn)
+        if key:
+            new[key] = page
+        yield load_page(page)
+    RenderedDocument.add_files(new)
+
 
+def write_pdf(pages) -> io.BytesIO:
+    """Write the pages to a PDF file in memory."""
+    doc = Document()
+    for page in pages:
+        doc.add_page(page)
     memory_file = io.BytesIO()
     PDF.dumps(memory_file, doc)
     memory_file.seek(0)
     return memory_file
 
 
-def get_employee_by_name(name: str):
-    if name in non_employees_list:
-        return None
-    parts = name.split(" ")
-    if len(parts) < 2:
-        raise ObjectDoesNotExist(f"Некорректный формат: {name}")
-    surname = name.split(" ")[0]
-    name = name.split(" ")[1]
-    if name[1] == ".":
-        employee = Employee.objects.filter(
-            surname=surname, name__startswith=name[0]
-        ).first()
-    else:
-        employee = Employee.objects.filter(surname=surname, name=name).first()
-    if employee:
-        return employee
-    raise ObjectDoesNotExist(f"Сотрудник {surname} {name} не добавлен!")
+def get_certificates_pdf(certificates) -> io.BytesIO:
+    """Get PDF of the certificates, see iter_certificate_pages."""
+    return write_pdf(iter_certificate_pages(certificates))
 
 
-def create_documents_for_last_month():
-    active_contracts = Contract.objects.filter(
-        Q(end_date__gte=last_day_of_the_previous_month()) | Q(end_date=None),
-        start_date__lte=last_day_of_the_previous_month(),
+class ZipStream:
+    """Write-only file for zipfile, written bytes are taken by pop."""
+
+    def __init__(self):
+        """Start with no data."""
+        self.chunks = []
+
+    def write(self, data) -> int:
+        """Keep written bytes until pop."""
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """Nothing to flush, zipfile calls it on close."""
+
+    def pop(self) -> bytes:
+        """Take bytes written since the last call."""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_certificates_zip(certificates):
+    """
+    Yield ZIP archive with one PDF per employee part by part.
+
+    Every employee file is written as soon as its pages are ready.
+    """
+    certificates = list(
+        certificates.select_related("contract__employee").order_by(
+            "contract__employee__surname",
+            "contract__employee_id",
+            "number",
+        )
+    )
+    pages = iter_certificate_pages(certificates)
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w") as archive:
+        for _, group in itertools.groupby(
+            certificates,
+            key=lambda certificate: certificate.contract.employee_id,
+        ):
+            group = list(group)
+            employee = group[0].contract.employee
+            archive.writestr(
+                f"{employee.full_name()} {employee.id}.pdf",
+                write_pdf(itertools.islice(pages, len(group))).getvalue(),
+            )
+            yield stream.pop()
+    # Finish the pages, so the drawn ones are cached.
+    next(pages, None)
+    yield stream.pop()
+
+
+def render_contracts(ids: list[int]) -> list[tuple[str, bytes]]:
+    """Fill templates of the contracts, return names and files."""
+    contracts = Contract.objects.select_related(
+        "employee", "template"
+    ).in_bulk(ids)
+    owner = Employee.objects.filter(is_owner=True).first()
+    return [
+        (
+            get_contract_file_name(contracts[id]),
+            create_contract(contracts[id], owner),
+        )
+        for id in ids
+    ]
+
+
+def check_templates(templates) -> dict[int, str]:
+    """Compile the templates, return {template id: error} of broken ones."""
+    errors = {}
+    for template in templates:
+        try:
+            compile_template(template.file.name)
+        except TemplateFail as e:
+            errors[template.id] = f"{template}: {e}"
+    return errors
+
+
+def iter_contracts_zip(contracts):
+    """
+    Yield ZIP archive of filled contract templates part by part.
+
+    Contracts are filled by chunks, in a pool for large selections. Check
+    their templates with check_templates before the response is started,
+    forked workers get them compiled.
+    """
+    ids = list(contracts.values_list("id", flat=True))
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w") as archive:
+        for files in map_chunks(render_contracts, ids):
+            for name, content in files:
+                archive.writestr(name, content)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def render_certificates(ids: list[int]) -> list[tuple[str, bytes]]:
+    """Render every certificate to a separate PDF, return names and files."""
+    certificates = SalaryCertificate.objects.filter(id__in=ids).select_related(
+        "contract__employee"
+    )
+    return [
+        (
+            f"{certificate.number} {certificate.contract.employee.full_name()}"
+            f".pdf",
+            create_pdf([certificate]).read(),
+        )
+        for certificate in certificates
+    ]
+
+
+def create_pdf(сertificates) -> io.BytesIO:
+    owner = Employee.objects.filter(is_owner=True).first()
+    create_list = get_renderer()
+    return write_pdf(
+        create_list(certificate, owner) for certificate in сertificates
+    )
+
+
+class EmployeeResolver:
+    """
+    Resolve names from FitBase reports to employees.
+
+    Employees are loaded once, after that every lookup is a dict access.
+    Build one resolver per import and pass it to everything that needs it.
+    """
+
+    def __init__(self, queryset=None):
+        """Build surname + name, surname + initial and id indexes."""
+        if queryset is None:
+            queryset = Employee.objects.all()
+        self.by_id = {}
+        self.by_full_name = {}
+        self.by_initial = {}
+        for employee in queryset.order_by("pk"):
+            self.by_id[employee.id] = employee
+            self.by_full_name.setdefault(
+                (employee.surname, employee.name), employee
+            )
+            self.by_initial.setdefault(
+                (employee.surname, employee.name[:1]), employee
+            )
+
+    def get(self, name: str):
+        """Get employee by full name or surname with initial from the report."""
+        if name in non_employees_list:
+            return None
+        parts = str(name).split(" ")
+        if len(parts) < 2:
+            raise ObjectDoesNotExist(f"Некорректный формат: {name}")
+        surname, name = parts[0], parts[1]
+        if name[1:2] == ".":
+            employee = self.by_initial.get((surname, name[0]))
+        else:
+            employee = self.by_full_name.get((surname, name))
+        if employee:
+            return employee
+        raise ObjectDoesNotExist(f"Сотрудник {surname} {name} не добавлен!")
+
+    def get_by_id(self, pk):
+        """Get employee by primary key."""
+        try:
+            return self.by_id[int(pk)]
+        except (KeyError, TypeError, ValueError):
+            raise ObjectDoesNotExist(f"Сотрудник {pk} не найден!")
+
+
+def create_documents(start_date, end_date) -> list[SalaryCertificate]:
+    """
+    Build unsaved certificates of the period for all active contracts.
+
+    Numbers are not reserved here, number the certificates with
+    set_new_numbers in the transaction that saves them.
+    """
+    active_contracts = list(
+        Contract.objects.filter(
+            Q(end_date__gte=end_date) | Q(end_date=None),
+            start_date__lte=end_date,
+        ).select_related("employee")
+    )
+    intervals = CertificateIntervals(
+        [contract.id for contract in active_contracts]
     )
-    counter = get_new_salary_certificate_number()
     docs = []
     for contract in active_contracts:
-        if contract.start_date > first_day_of_the_previous_month():
-            start_date = contract.start_date
-        else:
-            start_date = first_day_of_the_previous_month()
         doc = SalaryCertificate(
-            number=counter,
             contract=contract,
-            start_date=start_date,
-            end_date=last_day_of_the_previous_month(),
+            start_date=max(contract.start_date, start_date),
+            end_date=end_date,
         )
         try:
-            doc.full_clean()
+            doc.clean_fields(exclude=["contract"])
+            doc.validate_period(intervals)
         except ValidationError:
             continue
         else:
+            intervals.add(doc)
             docs.append(doc)
-            counter += 1
     return docs
+
+
+def create_documents_for_last_month():
+    return create_documents(
+        first_day_of_the_previous_month(), last_day_of_the_previous_month()
+    )
+
+
+def get_daily_totals(queryset, value, employee_ids, start, end) -> dict:
+    """Get {employee id: [(day, total)]} for the period in one query."""
+    totals = defaultdict(list)
+    rows = (
+        queryset.filter(employee_id__in=employee_ids, day__range=[start, end])
+        .values("employee_id", "day")
+        .annotate(total=value)
+        .values_list("employee_id", "day", "total")
+    )
+    for employee_id, day, total in rows:
+        totals[employee_id].append((day, total or 0))
+    return totals
+
+
+def get_period_total(totals: list, start, end):
+    return sum(total for day, total in totals if start <= day <= end)
+
+
+def calculate_certificates(
+    certificates, preview: bool = False
+) -> tuple[tuple[list, list, list], list[str]]:
+    """
+    Calculate many certificates by their template rules at once.
+
+    Accruals, sales and hours of all employees are loaded with one grouped
+    query each and split by certificate periods in memory, only changed
+    automatic fields are written in one transaction. Return created,
+    updated and deleted fields, with preview nothing is written, and errors
+    for certificates that can not be changed.
+    """
+    errors = []
+    editable = []
+    for certificate in certificates:
+        try:
+            certificate.check_editable()
+        except FieldError as e:
+            errors.append(f"{certificate}: {e}")
+        else:
+            editable.append(certificate)
+    if not editable:
+        return ([], [], []), errors
+    templates_by_id = get_templates_with_rules(
+        {certificate.contract.template_id for certificate in editable}
+    )
+    templates = templates_by_id.values()
+    employee_ids = {
+        certificate.contract.employee_id for certificate in editable
+    }
+    start = min(certificate.start_date for certificate in editable)
+    end = max(certificate.end_date for certificate in editable)
+
+    accruals = defaultdict(list)
+    if any(template.amount_of_accrual.all() for template in templates):
+        rows = (
+            Accrual.objects.annotate(
+                day=TruncDate("date"), full_name=get_accrual_full_name()
+            )
+            .filter(employee_id__in=employee_ids, day__range=[start, end])
+            .values("employee_id", "day", "full_name", "sum")
+            .annotate(count=Count("sum"))
+            .values_list("employee_id", "day", "full_name", "sum", "count")
+        )
+        for employee_id, day, full_name, price, count in rows:
+            accruals[employee_id].append((day, full_name, price, count))
+    sales = {}
+    if any(
+        getattr(template, "percentage_of_sales", None)
+        for template in templates
+    ):
+        sales = get_daily_totals(
+            Sale.objects.annotate(day=TruncDate("date")),
+            Sum("sum"),
+            employee_ids,
+            start,
+            end,
+        )
+    hours = {}
+    if any(
+        getattr(template, "hourly_payment", None) for template in templates
+    ):
+        hours = get_daily_totals(
+            Schedule.objects.annotate(day=F("date")),
+            Sum("time"),
+            employee_ids,
+            start,
+            end,
+        )
+
+    fields = []
+    for certificate in editable:
+        employee_id = certificate.contract.employee_id
+        start, end = certificate.start_date, certificate.end_date
+        lines = {}
+        for day, full_name, price, count in accruals[employee_id]:
+            if start <= day <= end:
+                key = (full_name, price)
+                lines[key] = lines.get(key, 0) + count
+        fields += certificate.get_auto_fields(
+            templates_by_id[certificate.contract.template_id],
+            accrual_lines=[
+                {"full_name": full_name, "sum": price, "count": count}
+                for (full_name, price), count in lines.items()
+            ],
+            sales_sum=get_period_total(sales.get(employee_id, []), start, end),
+            hours=get_period_total(hours.get(employee_id, []), start, end),
+        )
+    changes = get_auto_field_changes(
+        [certificate.id for certificate in editable], fields
+    )
+    if not preview:
+        apply_auto_field_changes(*changes)
+    return changes, errors
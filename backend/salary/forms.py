@@ -0,0 +1,28 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from exceptions import TemplateFail
+
+from .make_contract import compile_content
+from .models import ContractTemplate
+
+
+class ContractTemplateForm(forms.ModelForm):
+    """ContractTemplate form checking the uploaded template."""
+
+    class Meta:
+        """Meta class."""
+
+        model = ContractTemplate
+        fields = "__all__"
+
+    def clean_file(self):
+        """Validate file field."""
+        file = self.cleaned_data["file"]
+        if file and "file" in self.changed_data:
+            try:
+                compile_content(file.read())
+            except TemplateFail as e:
+                raise ValidationError(e)
+            finally:
+                file.seek(0)
+        return file
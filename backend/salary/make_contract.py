@@ -0,0 +1,126 @@
+import functools
+import io
+import os
+import re
+import zipfile
+
+from constants import date_pattern
+from core.models import Employee
+from django.template import Context, Engine, Template, TemplateSyntaxError
+from exceptions import TemplateFail
+
+from .models import Contract
+from .storage import template_storage
+
+# Plain text is filled as is, XML parts of docx and odt are escaped.
+text_engine = Engine(autoescape=False)
+xml_engine = Engine()
+
+# Word splits text in runs, so tags can get inside of {{ }}.
+placeholder = re.compile(r"\{(?:<[^>]*>)*\{(.*?)\}(?:<[^>]*>)*\}", re.S)
+xml_tag = re.compile(r"<[^>]*>")
+
+
+def join_placeholder(match: re.Match) -> str:
+    return "{{" + xml_tag.sub("", match.group(1)) + "}}"
+
+
+def compile_text(data: bytes, engine: Engine = text_engine) -> Template:
+    try:
+        text = data.decode()
+    except UnicodeDecodeError:
+        raise TemplateFail("Шаблон должен быть текстом, docx или odt")
+    try:
+        return Template(placeholder.sub(join_placeholder, text), engine=engine)
+    except TemplateSyntaxError as e:
+        raise TemplateFail(f"Ошибка в шаблоне: {e}")
+
+
+def compile_content(
+    content: bytes,
+) -> list[tuple[str, int | None, Template | bytes]]:
+    """
+    Compile template file content, raise TemplateFail if it is broken.
+
+    Parts of docx and odt files with placeholders become templates, other
+    parts are kept as bytes, all with their compression. ODF requires the
+    mimetype part to go first and uncompressed. Any other file is compiled
+    as text.
+    """
+    if not zipfile.is_zipfile(io.BytesIO(content)):
+        return [("", None, compile_text(content))]
+    parts = []
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            for part in archive.infolist():
+                data = archive.read(part)
+                if part.filename == "mimetype":
+                    parts.insert(0, (part.filename, zipfile.ZIP_STORED, data))
+                elif part.filename.endswith(".xml") and b"{" in data:
+                    parts.append(
+                        (
+                            part.filename,
+                            part.compress_type,
+                            compile_text(data, xml_engine),
+                        )
+                    )
+                else:
+                    parts.append((part.filename, part.compress_type, data))
+    except zipfile.BadZipFile as e:
+        raise TemplateFail(f"Повреждённый архив шаблона: {e}")
+    if not parts:
+        raise TemplateFail("Пустой архив шаблона")
+    return parts
+
+
+@functools.lru_cache(maxsize=32)
+def compile_template(
+    name: str,
+) -> list[tuple[str, int | None, Template | bytes]]:
+    """
+    Compile template file once per process.
+
+    File names are content hashes, so a cached template never gets stale.
+    """
+    with template_storage.open(name) as file:
+        return compile_content(file.read())
+
+
+def get_context(contract: Contract, owner: Employee) -> dict:
+    """Get data for placeholders like {{ employee.for_doc }}."""
+    return {
+        "employee": contract.employee,
+        "owner": owner,
+        "contract": contract,
+        "number": contract.number,
+        "date": contract.start_date.strftime(date_pattern),
+    }
+
+
+def render(template: Template, context: dict) -> str:
+    """Fill the template, escaping as the engine it was compiled with."""
+    return template.render(
+        Context(context, autoescape=template.engine.autoescape)
+    )
+
+
+def get_contract_file_name(contract: Contract) -> str:
+    return (
+        f"Договор №{contract.number} {contract.employee.full_name()}"
+        f"{os.path.splitext(contract.template.file.name)[1]}"
+    )
+
+
+def create_contract(contract: Contract, owner: Employee) -> bytes:
+    """Fill the template of the contract with its data."""
+    parts = compile_template(contract.template.file.name)
+    context = get_context(contract, owner)
+    if parts[0][0] == "":
+        return render(parts[0][2], context).encode()
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, "w") as archive:
+        for name, compress_type, part in parts:
+            if isinstance(part, Template):
+                part = render(part, context)
+            archive.writestr(name, part, compress_type=compress_type)
+    return memory_file.getvalue()
@@ -1,3 +1,7 @@
+import hashlib
+import io
+import json
+import pickle
 from decimal import Decimal
 
 from borb.io.read.types import Decimal
@@ -12,54 +16,194 @@ from borb.pdf import (
 )
 from constants import date_pattern
 from core.models import Employee
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
 from utils import format_money
 
 from backend.settings import CUSTOM_FONT
 
 from .models import SalaryCertificate
 
+# Change when create_list draws pages differently to drop cached files.
+layout_version = 1
+
+
+def get_renderer():
+    """Get function drawing certificate pages set by PDF_RENDERER."""
+    return import_string(settings.PDF_RENDERER)
+
+
+def get_page_key(document: SalaryCertificate, owner: Employee) -> str:
+    """Get hash of everything create_list puts on the certificate page."""
+    data = [
+        layout_version,
+        settings.PDF_RENDERER,
+        owner.for_doc(),
+        owner.short_name,
+        document.number,
+        document.date_of_creation,
+        document.start_date,
+        document.end_date,
+        document.total,
+        document.contract.number,
+        document.contract.start_date,
+        document.contract.employee.for_doc(),
+        document.contract.employee.short_name,
+        [
+            (field.id, field.name, field.count, field.unit, field.price)
+            for field in document.field.all()
+        ],
+    ]
+    return hashlib.sha256(
+        json.dumps(data, cls=DjangoJSONEncoder).encode()
+    ).hexdigest()
+
+
+class PagePickler(pickle.Pickler):
+    """Pickler leaving the shared font out of the page."""
+
+    def persistent_id(self, obj):
+        """Replace the font by a reference, it is most of the page size."""
+        if obj is CUSTOM_FONT:
+            return "font"
+        return None
+
+
+class PageUnpickler(pickle.Unpickler):
+    """Unpickler putting the shared font back into the page."""
+
+    def persistent_load(self, pid):
+        """Get the font by the reference."""
+        if pid != "font":
+            raise pickle.UnpicklingError(f"Неизвестный объект {pid}")
+        return CUSTOM_FONT
+
+
+def dump_page(page: Page) -> bytes:
+    """Serialize drawn page to pass it between processes or cache it."""
+    file = io.BytesIO()
+    PagePickler(file).dump(page)
+    return file.getvalue()
+
+
+def load_page(data: bytes) -> Page:
+    """Restore page serialized by dump_page."""
+    return PageUnpickler(io.BytesIO(data)).load()
+
+
+font_size = Decimal(10)
+small_font_size = Decimal(7)
+table_padding = Decimal(10)
+header_padding = Decimal(2)
+
+text_style = {"font": CUSTOM_FONT, "font_size": font_size}
+multiline_style = {**text_style, "respect_newlines_in_text": True}
+cell_style = {
+    **multiline_style,
+    "text_alignment": Alignment.CENTERED,
+    "horizontal_alignment": Alignment.CENTERED,
+    "respect_spaces_in_text": True,
+}
+signature_style = {**multiline_style, "respect_spaces_in_text": True}
+no_borders = {
+    "border_left": False,
+    "border_right": False,
+    "border_bottom": False,
+    "border_top": False,
+}
+table_header = (
+    "№ п/п",
+    "Наименование услуги",
+    "Кол-во",
+    "Ед.",
+    "Цена",
+    "Сумма",
+)
+# Relative column widths, borb scales them to the width of the page.
+# Proportions are close to what the flexible table measures.
+fixed_column_widths = [Decimal(width) for width in (50, 176, 55, 40, 75, 80)]
+
+
+def text_cell(text: str, style: dict, **cell_options) -> TableCell:
+    """Get table cell with a paragraph of the given style."""
+    return TableCell(Paragraph(text, **style), **cell_options)
+
+
+def add_rows(table, rows, style: dict, **cell_options):
+    """Add text cells of the rows to the table."""
+    for row in rows:
+        for text in row:
+            table.add(text_cell(text, style, **cell_options))
+    return table
+
+
+def get_item_rows(document: SalaryCertificate) -> list[tuple]:
+    """Get rows of the services table from the certificate fields."""
+    return [
+        (
+            str(counter),
+            name,
+            "{0:.2f}".format(count).rstrip("0").rstrip("."),
+            unit,
+            format_money(price),
+            format_money(count * price),
+        )
+        for counter, (name, count, unit, price) in enumerate(
+            document.get_data().values_list("name", "count", "unit", "price"),
+            start=1,
+        )
+    ]
+
+
+def get_flexible_table(number_of_rows: int) -> FlexibleColumnWidthTable:
+    """Get services table with widths measured by the content."""
+    return FlexibleColumnWidthTable(
+        number_of_columns=len(table_header), number_of_rows=number_of_rows
+    )
+
+
+def get_fixed_table(number_of_rows: int) -> FixedColumnWidthTable:
+    """Get services table with precomputed widths."""
+    return FixedColumnWidthTable(
+        number_of_columns=len(table_header),
+        number_of_rows=number_of_rows,
+        column_widths=fixed_column_widths,
+    )
+
 
 def create_list(document: SalaryCertificate, owner: Employee) -> Page:
+    """Draw the certificate with borb table widths measured by content."""
+    return draw_list(document, owner, get_flexible_table)
+
+
+def create_fixed_list(document: SalaryCertificate, owner: Employee) -> Page:
+    """Draw the certificate with precomputed table widths, much faster."""
+    return draw_list(document, owner, get_fixed_table)
+
+
+def draw_list(document: SalaryCertificate, owner: Employee, get_table) -> Page:
+    """Draw the certificate page, get_table builds the services table."""
     page = Page()
     layout = SingleColumnLayout(page)
-    document_data = []
-    for counter, field in enumerate(document.get_data()):
-        document_data.append(
-            map(
-                str,
-                [
-                    counter + 1,
-                    field.name,
-                    # need to fix
-                    "{0:.2f}".format(field.count).rstrip("0").rstrip("."),
-                    field.unit,
-                    format_money(field.price),
-                    format_money(field.summ()),
-                ],
-            )
-        )
     layout.add(
         FixedColumnWidthTable(number_of_columns=1, number_of_rows=1)
         .add(
-            TableCell(
-                Paragraph(
-                    f"Акт №{document.number} от "
-                    f"{document.date_of_creation.strftime(date_pattern)}г. "
-                    f"За период с {document.start_date.strftime(date_pattern)} "
-                    f"по {document.end_date.strftime(date_pattern)}.",
-                    font=CUSTOM_FONT,
-                    font_size=Decimal(10),
-                ),
+            text_cell(
+                f"Акт №{document.number} от "
+                f"{document.date_of_creation.strftime(date_pattern)}г. "
+                f"За период с {document.start_date.strftime(date_pattern)} "
+                f"по {document.end_date.strftime(date_pattern)}.",
+                text_style,
                 border_top=False,
                 border_left=False,
                 border_right=False,
             )
         )
         .set_padding_on_all_cells(
-            Decimal(2), Decimal(2), Decimal(2), Decimal(2)
+            header_padding, header_padding, header_padding, header_padding
         )
     )
-
     layout.add(
         Paragraph(
             f"Исполнитель: {document.contract.employee.for_doc()}\n\n"
@@ -67,120 +211,65 @@ def create_list(document: SalaryCertificate, owner: Employee) -> Page:
             f"Основание: Договор "
             f"возмездного оказания услуг №{document.contract.number} от "
             f"{document.contract.start_date.strftime(date_pattern)}г.",
-            font=CUSTOM_FONT,
-            font_size=Decimal(10),
-            respect_newlines_in_text=True,
+            **multiline_style,
         )
     )
-    table_data = [
-        ["№ п/п", "Наименование услуги", "Кол-во", "Ед.", "Цена", "Сумма"],
-        *document_data,
-        ["", "", "", "", "Итого:", document.get_sum()],
-        ["", "", "", "", "Без налога\n(НДС)", ""],
-    ]
-    table_separator = len(table_data) - 2
-    main_table = FlexibleColumnWidthTable(
-        number_of_columns=6, number_of_rows=len(table_data)
+    item_rows = get_item_rows(document)
+    total = document.get_sum()
+    main_table = get_table(len(item_rows) + 3)
+    add_rows(
+        main_table,
+        [table_header, *item_rows],
+        cell_style,
+        border_width=Decimal(0.5),
+    )
+    add_rows(
+        main_table,
+        [
+            ("", "", "", "", "Итого:", total),
+            ("", "", "", "", "Без налога\n(НДС)", ""),
+        ],
+        cell_style,
+        **no_borders,
     )
-    for line in table_data[:table_separator]:
-        for field in line:
-            main_table.add(
-                TableCell(
-                    Paragraph(
-                        field,
-                        font=CUSTOM_FONT,
-                        font_size=Decimal(10),
-                        text_alignment=Alignment.CENTERED,
-                        horizontal_alignment=Alignment.CENTERED,
-                        respect_newlines_in_text=True,
-                        respect_spaces_in_text=True,
-                    ),
-                    border_width=Decimal(0.5),
-                )
-            )
-    for line in table_data[table_separator:]:
-        for field in line:
-            main_table.add(
-                TableCell(
-                    Paragraph(
-                        field,
-                        font=CUSTOM_FONT,
-                        font_size=Decimal(10),
-                        text_alignment=Alignment.CENTERED,
-                        horizontal_alignment=Alignment.CENTERED,
-                        respect_newlines_in_text=True,
-                        respect_spaces_in_text=True,
-                    ),
-                    border_left=False,
-                    border_right=False,
-                    border_bottom=False,
-                    border_top=False,
-                )
-            )
     main_table.set_padding_on_all_cells(
-        Decimal(10), Decimal(10), Decimal(10), Decimal(10)
+        table_padding, table_padding, table_padding, table_padding
     )
     layout.add(main_table)
     layout.add(
         Paragraph(
-            f"Всего к оказано услуг на сумму {document.get_sum()}"
+            f"Всего к оказано услуг на сумму {total}"
             f" руб.\n\nВышеперечисленные услуги выполнены полностью и в срок. "
             f"Заказчик претензий по объему, качеству, срокам оказания услуг не"
             f" имеет.",
-            font=CUSTOM_FONT,
-            font_size=Decimal(7),
-            respect_newlines_in_text=True,
+            **{**multiline_style, "font_size": small_font_size},
         )
     )
 
-    signatures = [
-        ["ЗАКАЗЧИК:", "ИСПОЛНИТЕЛЬ:"],
-        [
-            f"________________ / {document.contract.employee.short_name} /"
-            f"\n      Подпись",
-            f"________________ / {owner.short_name} /\n" f"        Подпись",
-        ],
-    ]
     signatures_table = FixedColumnWidthTable(
         number_of_columns=2, number_of_rows=2
     )
-    for field in signatures[0]:
-        signatures_table.add(
-            TableCell(
-                Paragraph(
-                    field,
-                    font=CUSTOM_FONT,
-                    font_size=Decimal(10),
-                    padding_left=Decimal(30),
-                    respect_newlines_in_text=True,
-                    respect_spaces_in_text=True,
-                ),
-                border_left=False,
-                border_right=False,
-                border_bottom=False,
-                border_top=False,
-            )
-        )
-    for field in signatures[1]:
-        signatures_table.add(
-            TableCell(
-                Paragraph(
-                    field,
-                    font=CUSTOM_FONT,
-                    font_size=Decimal(10),
-                    padding_left=Decimal(20),
-                    respect_newlines_in_text=True,
-                    respect_spaces_in_text=True,
-                ),
-                border_left=False,
-                border_right=False,
-                border_bottom=False,
-                border_top=False,
+    add_rows(
+        signatures_table,
+        [("ЗАКАЗЧИК:", "ИСПОЛНИТЕЛЬ:")],
+        {**signature_style, "padding_left": Decimal(30)},
+        **no_borders,
+    )
+    add_rows(
+        signatures_table,
+        [
+            (
+                f"________________ / {document.contract.employee.short_name} /"
+                f"\n      Подпись",
+                f"________________ / {owner.short_name} /\n        Подпись",
             )
-        )
+        ],
+        {**signature_style, "padding_left": Decimal(20)},
+        **no_borders,
+    )
     signatures_table.no_borders()
     signatures_table.set_padding_on_all_cells(
-        Decimal(2), Decimal(2), Decimal(2), Decimal(2)
+        header_padding, header_padding, header_padding, header_padding
     )
     layout.add(signatures_table)
     return page
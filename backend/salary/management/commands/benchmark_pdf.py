@@ -0,0 +1,51 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from salary.benchmark import create_certificates
+from salary.crud import create_pdf
+from salary.make_pdf import create_fixed_list, create_list
+
+
+class Command(BaseCommand):
+    """Measure rendering of salary certificates."""
+
+    help = (
+        "Measure rendering of salary certificates on synthetic data. "
+        "All created rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        """Add generator options."""
+        parser.add_argument("--pages", type=int, default=20)
+        parser.add_argument("--lines", type=int, default=10)
+
+    def measure(self, name: str, pages: int, func):
+        """Run func and print pages/sec, then run it traced for memory."""
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"{name}: {pages} pages in {duration:.2f} s, "
+            f"{pages / duration:.1f} pages/s, "
+            f"peak memory {peak / 2**20:.1f} MB"
+        )
+
+    def handle(self, *args, **options):
+        """Benchmark launch point."""
+        pages = options["pages"]
+        with transaction.atomic():
+            certificates, owner = create_certificates(pages, options["lines"])
+            for renderer in (create_list, create_fixed_list):
+                self.measure(
+                    f"layout {renderer.__name__}",
+                    pages,
+                    lambda: [renderer(doc, owner) for doc in certificates],
+                )
+            self.measure("pdf", pages, lambda: create_pdf(certificates))
+            transaction.set_rollback(True)
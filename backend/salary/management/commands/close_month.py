@@ -0,0 +1,84 @@
+import datetime
+import os
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from salary.crud import (
+    calculate_certificates,
+    create_documents,
+    get_chunks,
+    get_process_pool,
+    render_certificates,
+)
+from salary.models import SalaryCertificate, set_new_numbers
+from utils import (
+    first_day_of_the_previous_month,
+    last_day_of_the_previous_month,
+)
+
+
+class Command(BaseCommand):
+    """Create, calculate and render salary certificates of the period."""
+
+    help = (
+        "Create, calculate and render salary certificates of the period. "
+        "By default the period is the last month."
+    )
+
+    def add_arguments(self, parser):
+        """Add period and output options."""
+        parser.add_argument(
+            "--start",
+            type=datetime.date.fromisoformat,
+            default=first_day_of_the_previous_month(),
+        )
+        parser.add_argument(
+            "--end",
+            type=datetime.date.fromisoformat,
+            default=last_day_of_the_previous_month(),
+        )
+        parser.add_argument("--output", default=None)
+        parser.add_argument("--workers", type=int, default=None)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Print duration of the stage."""
+        start = time.perf_counter()
+        yield
+        self.stdout.write(f"{name}: {time.perf_counter() - start:.2f} s")
+
+    def render(self, ids: list[int], output: str, workers: int) -> int:
+        """Render certificates by chunks in a pool of processes."""
+        os.makedirs(output, exist_ok=True)
+        count = 0
+        with get_process_pool(workers) as pool:
+            for files in pool.map(render_certificates, get_chunks(ids)):
+                for name, content in files:
+                    with open(os.path.join(output, name), "wb") as file:
+                        file.write(content)
+                count += len(files)
+        return count
+
+    def handle(self, *args, **options):
+        """Month-end close launch point."""
+        start, end = options["start"], options["end"]
+        output = options["output"] or f"salary_{start}_{end}"
+        with self.stage("create"):
+            docs = create_documents(start, end)
+            with transaction.atomic():
+                set_new_numbers(docs)
+                SalaryCertificate.objects.bulk_create(docs)
+        self.stdout.write(f"Создано актов: {len(docs)}")
+        if not docs:
+            return
+        with self.stage("calculate"):
+            _, errors = calculate_certificates(docs)
+            for error in errors:
+                self.stderr.write(error)
+        with self.stage("render"):
+            count = self.render(
+                [doc.id for doc in docs], output, options["workers"]
+            )
+        self.stdout.write(f"Сохранено документов: {count} в {output}")
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:32
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    SalaryCertificate = apps.get_model("salary", "SalaryCertificate")
+    Field = apps.get_model("salary", "Field")
+    SalaryCertificate.objects.update(
+        total=Coalesce(
+            models.Subquery(
+                Field.objects.filter(
+                    salary_certificate_id=models.OuterRef("id")
+                )
+                .values("salary_certificate_id")
+                .annotate(
+                    sum=models.Sum(models.F("price") * models.F("count"))
+                )
+                .values("sum")
+            ),
+            0,
+            output_field=models.FloatField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("salary", "0005_salarycertificate_have_receipt"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="salarycertificate",
+            name="total",
+            field=models.FloatField(
+                default=0, editable=False, verbose_name="Сумма"
+            ),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
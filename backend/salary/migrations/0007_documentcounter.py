@@ -0,0 +1,37 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("salary", "0006_salarycertificate_total"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(unique=True, verbose_name="Модель")),
+                (
+                    "value",
+                    models.IntegerField(
+                        default=0, verbose_name="Последний номер"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "счётчик номеров",
+                "verbose_name_plural": "счётчики номеров",
+            },
+        ),
+    ]
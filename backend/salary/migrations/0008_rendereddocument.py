@@ -0,0 +1,47 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:38
+
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("salary", "0007_documentcounter"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RenderedDocument",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        unique=True, verbose_name="Хэш содержимого"
+                    ),
+                ),
+                ("content", models.BinaryField(verbose_name="PDF")),
+                ("size", models.IntegerField(verbose_name="Размер")),
+                (
+                    "last_used",
+                    models.DateTimeField(
+                        default=datetime.datetime.today,
+                        verbose_name="Последнее использование",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "сохранённый документ",
+                "verbose_name_plural": "сохранённые документы",
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:48
+
+import os
+
+import salary.storage
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+def move_file_data(apps, schema_editor):
+    ContractTemplate = apps.get_model("salary", "ContractTemplate")
+    for template in ContractTemplate.objects.exclude(file_data=None):
+        name = os.path.basename(template.file.name or "") or "template"
+        template.file.save(
+            name, ContentFile(bytes(template.file_data)), save=False
+        )
+        template.save(update_fields=["file"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("salary", "0008_rendereddocument"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="contracttemplate",
+            name="file",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=salary.storage.ContentAddressedStorage(),
+                upload_to="templates/",
+            ),
+        ),
+        migrations.RunPython(move_file_data, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="contracttemplate",
+            name="file_data",
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:05
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("salary", "0009_template_file_storage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="contract",
+            name="number",
+            field=models.IntegerField(
+                blank=True,
+                help_text="Если не указан, присваивается при сохранении",
+                unique=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+                verbose_name="Номер договора",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="salarycertificate",
+            name="number",
+            field=models.IntegerField(
+                blank=True,
+                help_text="Если не указан, присваивается при сохранении",
+                unique=True,
+                verbose_name="Номер документа",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+def clear_cache(apps, schema_editor):
+    """Drop files of whole selections, pages are cached instead."""
+    apps.get_model("salary", "RenderedDocument").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("salary", "0010_number_reserved_on_save"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_cache, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name="rendereddocument",
+            options={
+                "verbose_name": "сохранённая страница",
+                "verbose_name_plural": "сохранённые страницы",
+            },
+        ),
+        migrations.AlterField(
+            model_name="rendereddocument",
+            name="content",
+            field=models.BinaryField(verbose_name="Страница"),
+        ),
+    ]
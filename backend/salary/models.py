@@ -1,19 +1,22 @@
+import bisect
 import datetime
 from decimal import Decimal
 
 from constants import date_pattern
-from core.models import Employee, Schedule
+from core.models import Employee
+from django.conf import settings
 from django.core.exceptions import FieldError, ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models.functions import Concat
-from report.models import Accrual, Sale
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Concat
 from utils import (
     first_day_of_the_previous_month,
     format_money,
     last_day_of_the_previous_month,
 )
 
+from .storage import template_storage
+
 
 class ContractTemplate(models.Model):
     """ContractTemplate model."""
@@ -26,24 +29,89 @@ class ContractTemplate(models.Model):
 
     name = models.CharField("Название")
     description = models.CharField("Описание", null=True, blank=True)
-    file = models.FileField(null=True, blank=True)
-    file_data = models.BinaryField(null=True)
+    file = models.FileField(
+        null=True,
+        blank=True,
+        upload_to="templates/",
+        storage=template_storage,
+    )
     is_active = models.BooleanField("Шаблон активен", default=True)
 
     def __str__(self):
         return self.name
 
 
+class DocumentCounter(models.Model):
+    """Last reserved number of the documents of a model."""
+
+    class Meta:
+        """DocumentCounter metaclass."""
+
+        verbose_name = "счётчик номеров"
+        verbose_name_plural = "счётчики номеров"
+
+    name = models.CharField("Модель", unique=True)
+    value = models.IntegerField("Последний номер", default=0)
+
+    def __str__(self):
+        return f"{self.name} {self.value}"
+
+
+def reserve_numbers(model, count: int = 1) -> int:
+    """
+    Reserve a block of document numbers, return the first of them.
+
+    The counter row is locked until the end of the transaction, so
+    concurrent reservations get different blocks. Numbers entered by hand
+    above the counter are skipped. Call it in the transaction that saves
+    the documents, so a failed save gives the numbers back.
+    """
+    with transaction.atomic():
+        counter, _ = DocumentCounter.objects.select_for_update().get_or_create(
+            name=model._meta.label_lower
+        )
+        last_number = max(
+            counter.value,
+            model.objects.aggregate(models.Max("number"))["number__max"] or 0,
+        )
+        counter.value = last_number + count
+        counter.save(update_fields=["value"])
+    return last_number + 1
+
+
+def set_new_numbers(documents) -> None:
+    """Give new documents without a number one reserved block of numbers."""
+    documents = [document for document in documents if document.number is None]
+    if not documents:
+        return
+    first_number = reserve_numbers(type(documents[0]), len(documents))
+    for number, document in enumerate(documents, start=first_number):
+        document.number = number
+
+
+class NumberedDocument(models.Model):
+    """Document which gets the next number on the first save."""
+
+    class Meta:
+        """NumberedDocument metaclass."""
+
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        """Reserve number in the transaction of the save."""
+        if self.number is not None:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            set_new_numbers([self])
+            return super().save(*args, **kwargs)
+
+
 def get_new_contract_number():
-    last_number = Contract.objects.aggregate(models.Max("number"))[
-        "number__max"
-    ]
-    if last_number:
-        return last_number + 1
-    return 1
+    """Former default of Contract.number, kept for old migrations."""
+    return None
 
 
-class Contract(models.Model):
+class Contract(NumberedDocument):
     """Contract model."""
 
     class Meta:
@@ -70,7 +138,8 @@ class Contract(models.Model):
     number = models.IntegerField(
         "Номер договора",
         unique=True,
-        default=get_new_contract_number,
+        blank=True,
+        help_text="Если не указан, присваивается при сохранении",
         validators=[
             MinValueValidator(1),
         ],
@@ -112,16 +181,22 @@ class Contract(models.Model):
         return self.admin_name()
 
 
+def get_accrual_full_name() -> models.Case:
+    """Get accrual field name: name and base joined by a space."""
+    return models.Case(
+        models.When(name=None, then=models.F("base")),
+        models.When(base=None, then=models.F("name")),
+        default=Concat("name", models.Value(" "), "base"),
+        output_field=models.CharField(),
+    )
+
+
 def get_new_salary_certificate_number():
-    last_number = SalaryCertificate.objects.aggregate(models.Max("number"))[
-        "number__max"
-    ]
-    if last_number:
-        return last_number + 1
-    return 1
+    """Former default of SalaryCertificate.number, kept for old migrations."""
+    return None
 
 
-class SalaryCertificate(models.Model):
+class SalaryCertificate(NumberedDocument):
     """SalaryCertificate model."""
 
     class Meta:
@@ -133,7 +208,8 @@ class SalaryCertificate(models.Model):
     number = models.IntegerField(
         "Номер документа",
         unique=True,
-        default=get_new_salary_certificate_number,
+        blank=True,
+        help_text="Если не указан, присваивается при сохранении",
     )
     start_date = models.DateField(
         "Начало отчётного периода", default=first_day_of_the_previous_month
@@ -155,13 +231,18 @@ class SalaryCertificate(models.Model):
         related_name="salary_certificate",
         verbose_name="договор",
     )
+    total = models.FloatField("Сумма", default=0, editable=False)
 
     def clean(self):
         """Validate start and end dates. Elimination of intersections."""
         super().clean()
-        errors = {}
         if self.contract_id is None:
-            raise ValidationError(errors)
+            raise ValidationError({})
+        self.validate_period(CertificateIntervals([self.contract_id]))
+
+    def validate_period(self, intervals: "CertificateIntervals"):
+        """Check the period against the contract and its other certificates."""
+        errors = {}
         if self.end_date and self.start_date > self.end_date:
             errors["start_date"] = "Дата начала не может быть позже конца!"
         if self.start_date < self.contract.start_date:
@@ -174,151 +255,108 @@ class SalaryCertificate(models.Model):
                 f"Не может быть позже расторжения договора "
                 f"{self.contract.end_date.strftime(date_pattern)}"
             )
-        start_overlap = (
-            SalaryCertificate.objects.filter(
-                contract=self.contract,
-                end_date__gte=self.start_date,
-                start_date__lte=self.start_date,
-            )
-            .exclude(id=self.id)
-            .first()
+        start_overlap = intervals.find(
+            self.contract_id, self.start_date, self.id
         )
         if start_overlap:
             errors["start_date"] = (
                 f"Последний акт закончился "
-                f"{start_overlap.end_date.strftime(date_pattern)}!"
-            )
-        end_overlap = (
-            SalaryCertificate.objects.filter(
-                contract=self.contract,
-                end_date__gte=self.end_date,
-                start_date__lte=self.end_date,
+                f"{start_overlap.strftime(date_pattern)}!"
             )
-            .exclude(id=self.id)
-            .first()
-        )
+        end_overlap = intervals.find(self.contract_id, self.end_date, self.id)
         if end_overlap:
             errors["end_date"] = (
                 f"Следующий акт закончился "
-                f"{end_overlap.end_date.strftime(date_pattern)}!"
+                f"{end_overlap.strftime(date_pattern)}!"
             )
         if errors:
             raise ValidationError(errors)
 
-    def calculate(self):
-        """Calculate by template rules."""
-        if self.is_blocked:
-            raise FieldError("Заблокирован от изменений")
-        if self.original_signed:
-            raise FieldError("Оригинал уже подписан")
-        Field.objects.filter(
-            salary_certificate_id=self.id,
-            is_auto=True,
-        ).delete()
-        required_fields = AmountOfAccrual.objects.filter(
-            contract=self.contract.template
-        )
+    def get_auto_fields(
+        self, template, accrual_lines, sales_sum, hours
+    ) -> list["Field"]:
+        """Build automatic fields by template rules from loaded data."""
+        fields = []
+        required_fields = template.amount_of_accrual.all()
         if required_fields:
-            query = (
-                Accrual.objects.filter(
-                    employee=self.contract.employee,
-                    date__date__range=[self.start_date, self.end_date],
-                )
-                .values("employee")
-                .annotate(
-                    full_name=models.Case(
-                        models.When(name=None, then=models.F("base")),
-                        models.When(base=None, then=models.F("name")),
-                        default=Concat("name", models.Value(" "), "base"),
-                        output_field=models.CharField(),
-                    ),
-                    count=models.Count("sum"),
-                )
-                .values("full_name", "count", "sum")
-            )
-            # add check required fields in set
             compile_required = set(
                 ((i.required_field, i.value) for i in required_fields)
             )
-            for line in query:
-                if (line["full_name"], line["sum"]) in compile_required:
-                    compile_required.remove((line["full_name"], line["sum"]))
-                Field.objects.get_or_create(
-                    salary_certificate_id=self.id,
-                    name=line["full_name"],
-                    price=line["sum"],
-                    count=line["count"],
-                    is_auto=True,
+            for line in accrual_lines:
+                compile_required.discard((line["full_name"], line["sum"]))
+                fields.append(
+                    Field(
+                        salary_certificate_id=self.id,
+                        name=line["full_name"],
+                        price=line["sum"],
+                        count=line["count"],
+                        is_auto=True,
+                    )
                 )
             for name, price in compile_required:
-                Field.objects.get_or_create(
-                    salary_certificate_id=self.id,
-                    name=name,
-                    price=price,
-                    is_auto=True,
+                fields.append(
+                    Field(
+                        salary_certificate_id=self.id,
+                        name=name,
+                        price=price,
+                        is_auto=True,
+                    )
                 )
-        # RATE data
-        # NEED TO EDIT
-        rates = Rate.objects.filter(contract=self.contract.template)
-        if rates:
-            for rate in rates:
-                Field.objects.get_or_create(
+        for rate in template.rate.all():
+            fields.append(
+                Field(
                     salary_certificate_id=self.id,
                     name=rate.name,
                     count=1,
                     price=rate.value,
                     is_auto=True,
                 )
-        # PercentageOfSales date
-        percent = PercentageOfSales.objects.filter(
-            contract=self.contract.template
-        ).first()
+            )
+        percent = getattr(template, "percentage_of_sales", None)
         if percent:
-            query = (
-                Sale.objects.filter(
-                    employee=self.contract.employee,
-                    date__date__range=[self.start_date, self.end_date],
-                )
-                .values("employee")
-                .annotate(
-                    result=models.Sum("sum"),
+            fields.append(
+                Field(
+                    salary_certificate_id=self.id,
+                    name=percent.name,
+                    count=1,
+                    price=sales_sum * float(percent.percentage_value) / 100,
+                    is_auto=True,
                 )
-                .values_list("result", flat=True)
-            )
-            if query:
-                summ = query[0] * float(percent.percentage_value) / 100
-            else:
-                summ = 0
-            Field.objects.get_or_create(
-                salary_certificate_id=self.id,
-                name=percent.name,
-                count=1,
-                price=summ,
-                is_auto=True,
             )
-        # HourlyPayment
-        payment = HourlyPayment.objects.filter(
-            contract=self.contract.template
-        ).first()
+        payment = getattr(template, "hourly_payment", None)
         if payment:
-            query = (
-                Schedule.objects.filter(
-                    employee=self.contract.employee,
-                    date__range=[self.start_date, self.end_date],
-                )
-                .values("employee")
-                .annotate(
-                    result=models.Sum("time"),
+            fields.append(
+                Field(
+                    salary_certificate_id=self.id,
+                    name=payment.name,
+                    count=hours,
+                    price=payment.value,
+                    is_auto=True,
                 )
-                .values_list("result", flat=True)
-            )
-            Field.objects.get_or_create(
-                salary_certificate_id=self.id,
-                name=payment.name,
-                count=query[0],
-                price=payment.value,
-                is_auto=True,
             )
+        return fields
+
+    def check_editable(self):
+        """Raise FieldError if the certificate can not be changed."""
+        if self.is_blocked:
+            raise FieldError("Заблокирован от изменений")
+        if self.original_signed:
+            raise FieldError("Оригинал уже подписан")
+
+    def calculate(self, preview: bool = False) -> tuple[list, list, list]:
+        """
+        Calculate by template rules.
+
+        Only changed automatic fields are written. Return created, updated
+        and deleted fields, with preview nothing is written.
+        """
+        from .crud import calculate_certificates
+
+        self.check_editable()
+        changes, _ = calculate_certificates([self], preview)
+        if not preview and any(changes):
+            self.refresh_from_db(fields=["total"])
+        return changes
 
     def get_data(self):
         """Get table data for doc."""
@@ -328,13 +366,7 @@ class SalaryCertificate(models.Model):
 
     def get_sum(self):
         """Total amount."""
-        summ = (
-            Field.objects.filter(salary_certificate_id=self.id)
-            .annotate(sum=models.F("price") * models.F("count"))
-            .aggregate(full_sum=models.Sum("sum"))["full_sum"]
-            or 0
-        )
-        return format_money(summ)
+        return format_money(self.total)
 
     get_sum.short_description = "Сумма"
 
@@ -351,7 +383,7 @@ class SalaryCertificate(models.Model):
 
     def __str__(self):
         value = (
-            f"#{self.number} от "
+            f"#{self.number or '?'} от "
             f"{self.date_of_creation.strftime(date_pattern)} "
             f"{self.contract.employee.full_name()}"
         )
@@ -361,6 +393,129 @@ class SalaryCertificate(models.Model):
         return value
 
 
+class CertificateIntervals:
+    """
+    Periods of the certificates of contracts for overlap checks.
+
+    Certificates are loaded with one query, after that every check only
+    looks through the periods of the contract started before the date.
+    """
+
+    def __init__(self, contract_ids):
+        """Load periods of the contracts sorted by start date."""
+        self.periods = {}
+        for id, contract_id, start_date, end_date in (
+            SalaryCertificate.objects.filter(contract_id__in=contract_ids)
+            .order_by("start_date")
+            .values_list("id", "contract_id", "start_date", "end_date")
+        ):
+            self.periods.setdefault(contract_id, []).append(
+                (start_date, end_date, id)
+            )
+
+    def find(self, contract_id, date, exclude_id=None):
+        """Get end date of the certificate which period contains the date."""
+        periods = self.periods.get(contract_id, [])
+        index = bisect.bisect_right(periods, (date, datetime.date.max))
+        # An earlier and longer period can contain the date as well, so
+        # every period started before the date is checked.
+        for start_date, end_date, id in reversed(periods[:index]):
+            if end_date >= date and id != exclude_id:
+                return end_date
+        return None
+
+    def add(self, certificate):
+        """Add period of the new certificate."""
+        bisect.insort(
+            self.periods.setdefault(certificate.contract_id, []),
+            (
+                certificate.start_date,
+                certificate.end_date,
+                certificate.id or 0,
+            ),
+        )
+
+
+def get_templates_with_rules(template_ids) -> dict:
+    """Load templates with all their rules, one query per rule type."""
+    return (
+        ContractTemplate.objects.select_related(
+            "percentage_of_sales", "hourly_payment"
+        )
+        .prefetch_related("amount_of_accrual", "rate")
+        .in_bulk(template_ids)
+    )
+
+
+def get_auto_field_changes(
+    certificate_ids, fields: list["Field"]
+) -> tuple[list, list, list]:
+    """Compare calculated automatic fields with the stored ones by name."""
+    stored = {
+        (field.salary_certificate_id, field.name): field
+        for field in Field.objects.filter(
+            salary_certificate_id__in=certificate_ids, is_auto=True
+        )
+    }
+    created = []
+    updated = []
+    for field in fields:
+        old = stored.pop((field.salary_certificate_id, field.name), None)
+        if old is None:
+            created.append(field)
+        elif (old.price, old.count, old.unit) != (
+            field.price,
+            field.count,
+            field.unit,
+        ):
+            old.price, old.count, old.unit = (
+                field.price,
+                field.count,
+                field.unit,
+            )
+            updated.append(old)
+    return created, updated, list(stored.values())
+
+
+def apply_auto_field_changes(created, updated, deleted) -> None:
+    """Write only the changed automatic fields."""
+    if not (created or updated or deleted):
+        return
+    with transaction.atomic():
+        if deleted:
+            Field.objects.filter(
+                id__in=[field.id for field in deleted]
+            ).delete()
+        if updated:
+            Field.objects.bulk_update(updated, ["price", "count", "unit"])
+        if created:
+            Field.objects.bulk_create(created)
+        update_totals(
+            {field.salary_certificate_id for field in created + updated}
+            | {field.salary_certificate_id for field in deleted}
+        )
+
+
+def update_totals(certificate_ids) -> None:
+    """Store the sum of the fields in the certificates with one query."""
+    SalaryCertificate.objects.filter(id__in=certificate_ids).update(
+        total=Coalesce(
+            models.Subquery(
+                Field.objects.filter(
+                    salary_certificate_id=models.OuterRef("id")
+                )
+                .values("salary_certificate_id")
+                .annotate(
+                    sum=models.Sum(models.F("price") * models.F("count"))
+                )
+                .values("sum")
+            ),
+            0,
+            output_field=models.FloatField(),
+        )
+    )
+
+
 class Field(models.Model):
     """Salary certificate table fields."""
 
@@ -385,9 +540,36 @@ class Field(models.Model):
         SalaryCertificate, on_delete=models.CASCADE, related_name="field"
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the certificate the field was loaded with."""
+        instance = super().from_db(db, field_names, values)
+        instance.saved_certificate_id = instance.__dict__.get(
+            "salary_certificate_id"
+        )
+        return instance
+
     def __str__(self):
         return f"{self.name} {self.price} x {self.count} = {self.summ()}р."
 
+    def save(self, *args, **kwargs):
+        """Update totals of the certificate and of the previous one."""
+        super().save(*args, **kwargs)
+        update_totals(
+            {
+                getattr(self, "saved_certificate_id", None),
+                self.salary_certificate_id,
+            }
+            - {None}
+        )
+        self.saved_certificate_id = self.salary_certificate_id
+
+    def delete(self, *args, **kwargs):
+        """Update total of the certificate."""
+        result = super().delete(*args, **kwargs)
+        update_totals([self.salary_certificate_id])
+        return result
+
     def summ(self):
         """Summ."""
         return self.count * self.price
@@ -513,3 +695,71 @@ class HourlyPayment(models.Model):
 
     def __str__(self):
         return " ".join(map(str, [self.name, self.value]))
+
+
+class RenderedDocument(models.Model):
+    """Page of a signed or blocked certificate kept for repeated downloads."""
+
+    class Meta:
+        """RenderedDocument metaclass."""
+
+        verbose_name = "сохранённая страница"
+        verbose_name_plural = "сохранённые страницы"
+
+    key = models.CharField("Хэш содержимого", unique=True)
+    content = models.BinaryField("Страница")
+    size = models.IntegerField("Размер")
+    last_used = models.DateTimeField(
+        "Последнее использование", default=datetime.datetime.today
+    )
+
+    def __str__(self):
+        return f"{self.key} {self.size}"
+
+    @classmethod
+    def get_files(cls, keys) -> dict[str, bytes]:
+        """Get {key: content} of the cached files and mark them as used."""
+        files = {
+            key: bytes(content)
+            for key, content in cls.objects.filter(key__in=keys).values_list(
+                "key", "content"
+            )
+        }
+        if files:
+            cls.objects.filter(key__in=files).update(
+                last_used=datetime.datetime.today()
+            )
+        return files
+
+    @classmethod
+    def add_files(cls, files: dict[str, bytes]):
+        """Cache {key: content} files and evict the least recently used."""
+        if not files:
+            return
+        cls.objects.bulk_create(
+            [
+                cls(key=key, content=content, size=len(content))
+                for key, content in files.items()
+            ],
+            ignore_conflicts=True,
+        )
+        cls.evict(settings.PDF_CACHE_SIZE)
+
+    @classmethod
+    def evict(cls, max_size: int):
+        """Remove the least recently used files above max_size bytes."""
+        if (cls.objects.aggregate(models.Sum("size"))["size__sum"] or 0) <= (
+            max_size
+        ):
+            return
+        total = 0
+        for id, size, last_used in cls.objects.order_by(
+            "-last_used", "-id"
+        ).values_list("id", "size", "last_used"):
+            total += size
+            if total > max_size:
+                cls.objects.filter(
+                    models.Q(last_used__lt=last_used)
+                    | models.Q(last_used=last_used, id__lte=id)
+                ).delete()
+                return
@@ -11,3 +11,4 @@ class SalaryCertificateSerializer(serializers.ModelSerializer):
 
         model = SalaryCertificate
         fields = "__all__"
+        read_only_fields = ("number",)
@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage naming files by the hash of their content.
+
+    Equal files are stored once: saving the same content again returns the
+    name of the stored file.
+    """
+
+    def get_content_name(self, name: str, content) -> str:
+        """Get name from sha256 of the content, keep directory and suffix."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, file_name = os.path.split(name)
+        content_hash = digest.hexdigest()
+        return os.path.join(
+            directory,
+            content_hash[:2],
+            content_hash + os.path.splitext(file_name)[1].lower(),
+        )
+
+    def save(self, name, content, max_length=None):
+        """Save the file once for every content."""
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+template_storage = ContentAddressedStorage()
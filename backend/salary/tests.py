@@ -0,0 +1,433 @@
+import datetime
+import io
+import tempfile
+import zipfile
+from unittest import mock
+
+from borb.pdf import PDF
+from borb.toolkit import SimpleTextExtraction
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.exceptions import FieldError, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from .benchmark import create_certificates
+from .crud import (
+    check_templates,
+    create_pdf,
+    get_certificates_pdf,
+    iter_contracts_zip,
+    pdf_chunk_size,
+)
+from .forms import ContractTemplateForm
+from .make_pdf import dump_page
+from .models import (
+    Contract,
+    ContractTemplate,
+    Field,
+    Rate,
+    RenderedDocument,
+    SalaryCertificate,
+)
+
+
+class ChangelistQueriesTest(TestCase):
+    """Changelist pages take the same number of queries for any size."""
+
+    certificate_queries = 9
+    contract_queries = 6
+
+    def setUp(self):
+        """Log in as a superuser."""
+        self.client.force_login(
+            User.objects.create_superuser("admin", password="admin")
+        )
+
+    def assert_changelist_queries(self, url_name: str, rows: int, queries):
+        """Open the changelist of rows certificates, count queries."""
+        create_certificates(rows, lines=2)
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data["cl"].result_count, rows)
+
+    def test_salary_certificate_changelist_5_rows(self):
+        """Check certificate changelist of 5 rows."""
+        self.assert_changelist_queries(
+            "admin:salary_salarycertificate_changelist",
+            5,
+            self.certificate_queries,
+        )
+
+    def test_salary_certificate_changelist_100_rows(self):
+        """Check certificate changelist of 100 rows."""
+        self.assert_changelist_queries(
+            "admin:salary_salarycertificate_changelist",
+            100,
+            self.certificate_queries,
+        )
+
+    def test_contract_changelist_5_rows(self):
+        """Check contract changelist of 5 rows."""
+        self.assert_changelist_queries(
+            "admin:salary_contract_changelist", 5, self.contract_queries
+        )
+
+    def test_contract_changelist_100_rows(self):
+        """Check contract changelist of 100 rows."""
+        self.assert_changelist_queries(
+            "admin:salary_contract_changelist", 100, self.contract_queries
+        )
+
+
+class CertificatePeriodTest(TestCase):
+    """Certificates of a contract can not overlap."""
+
+    def setUp(self):
+        """Store a long certificate with a short one inside of it."""
+        certificates, _ = create_certificates(1, lines=0)
+        self.contract = certificates[0].contract
+        SalaryCertificate.objects.filter(contract=self.contract).delete()
+        for number, start, end in (
+            (1, datetime.date(2024, 4, 1), datetime.date(2024, 12, 31)),
+            (2, datetime.date(2024, 5, 1), datetime.date(2024, 5, 10)),
+        ):
+            SalaryCertificate.objects.create(
+                contract=self.contract,
+                number=number,
+                start_date=start,
+                end_date=end,
+            )
+
+    def test_period_inside_earlier_certificate(self):
+        """Reject period inside of an earlier and longer certificate."""
+        certificate = SalaryCertificate(
+            contract=self.contract,
+            number=3,
+            start_date=datetime.date(2024, 6, 1),
+            end_date=datetime.date(2024, 6, 5),
+        )
+        with self.assertRaises(ValidationError) as error:
+            certificate.clean()
+        self.assertEqual(
+            set(error.exception.message_dict), {"start_date", "end_date"}
+        )
+
+    def test_period_after_certificates(self):
+        """Accept period after all certificates."""
+        SalaryCertificate(
+            contract=self.contract,
+            number=3,
+            start_date=datetime.date(2025, 1, 1),
+            end_date=datetime.date(2025, 1, 31),
+        ).clean()
+
+
+class NumberReservationTest(TestCase):
+    """Numbers are reserved only when documents are saved."""
+
+    def setUp(self):
+        """Log in as a superuser and create contracts."""
+        self.client.force_login(
+            User.objects.create_superuser("admin", password="admin")
+        )
+        self.certificates, _ = create_certificates(3, lines=0)
+
+    def test_unsaved_documents_do_not_reserve(self):
+        """Reserve number on save, not on instantiation."""
+        contract = self.certificates[0].contract
+        Contract()
+        SalaryCertificate()
+        certificate = SalaryCertificate.objects.create(
+            contract=contract,
+            start_date=datetime.date(2024, 2, 1),
+            end_date=datetime.date(2024, 2, 29),
+        )
+        self.assertEqual(certificate.number, self.certificates[-1].number + 1)
+
+    def test_create_multiple_preview_does_not_reserve(self):
+        """Reserve numbers on confirm, not on preview."""
+        url = reverse("admin:create_multiple")
+        self.client.get(url)
+        self.client.get(url)
+        self.client.post(url)
+        self.assertEqual(
+            list(
+                SalaryCertificate.objects.exclude(
+                    id__in=[doc.id for doc in self.certificates]
+                )
+                .order_by("number")
+                .values_list("number", flat=True)
+            ),
+            [self.certificates[-1].number + i for i in range(1, 4)],
+        )
+
+
+class CalculateTest(TestCase):
+    """Calculation of one certificate writes the same as of many."""
+
+    def setUp(self):
+        """Create certificate with a rate rule."""
+        certificates, _ = create_certificates(1, lines=0)
+        self.certificate = certificates[0]
+        Rate.objects.create(
+            name="Ставка",
+            value=1000,
+            contract=self.certificate.contract.template,
+        )
+
+    def test_calculate(self):
+        """Preview nothing, then store the field and the total."""
+        created, _, _ = self.certificate.calculate(preview=True)
+        self.assertEqual([field.name for field in created], ["Ставка"])
+        self.assertFalse(Field.objects.exists())
+        self.certificate.calculate()
+        self.assertEqual(self.certificate.total, 1000)
+        self.assertEqual(self.certificate.calculate(), ([], [], []))
+
+    def test_calculate_blocked(self):
+        """Raise for a certificate that can not be changed."""
+        self.certificate.is_blocked = True
+        with self.assertRaises(FieldError):
+            self.certificate.calculate()
+
+
+class FieldTotalsTest(TestCase):
+    """Saving a field updates totals of the certificates it was moved by."""
+
+    def test_move_field(self):
+        """Update totals of the old and of the new certificate."""
+        certificates, _ = create_certificates(2, lines=1)
+        field = Field.objects.get(salary_certificate=certificates[0])
+        field.name = "Перенесённое занятие"
+        field.salary_certificate = certificates[1]
+        field.save()
+        self.assertEqual(
+            [
+                certificate.total
+                for certificate in SalaryCertificate.objects.filter(
+                    id__in=[certificate.id for certificate in certificates]
+                ).order_by("number")
+            ],
+            [0, 2 * certificates[1].total],
+        )
+
+
+class PdfRendererTest(TestCase):
+    """Both page renderers put the same text on the page."""
+
+    def get_text(self, renderer: str, certificates) -> str:
+        """Render certificates with the renderer, extract page text."""
+        with override_settings(PDF_RENDERER=renderer):
+            content = create_pdf(certificates)
+        extraction = SimpleTextExtraction()
+        PDF.loads(content, [extraction])
+        return extraction.get_text()[0]
+
+    def test_same_text(self):
+        """Compare text of flexible and fixed tables."""
+        certificates, _ = create_certificates(1, lines=5)
+        text = self.get_text("salary.make_pdf.create_list", certificates)
+        self.assertIn("Групповое занятие 4", text)
+        self.assertEqual(
+            self.get_text("salary.make_pdf.create_fixed_list", certificates),
+            text,
+        )
+
+
+class CertificatePagesTest(TransactionTestCase):
+    """Pages are cached per certificate and drawn in a pool."""
+
+    def get_texts(self, content: io.BytesIO) -> list[str]:
+        """Extract text of every page."""
+        extraction = SimpleTextExtraction()
+        PDF.loads(content, [extraction])
+        return list(extraction.get_text().values())
+
+    def test_cached_pages(self):
+        """Draw only pages of certificates that are not fixed or cached."""
+        certificates, _ = create_certificates(3, lines=2)
+        for certificate in certificates[:2]:
+            certificate.original_signed = True
+            certificate.save()
+        texts = self.get_texts(get_certificates_pdf(certificates[:1]))
+        self.assertEqual(RenderedDocument.objects.count(), 1)
+        with mock.patch("salary.crud.dump_page", wraps=dump_page) as dump:
+            content = get_certificates_pdf(certificates)
+        self.assertEqual(dump.call_count, 2)
+        self.assertEqual(RenderedDocument.objects.count(), 2)
+        self.assertEqual(self.get_texts(content)[:1], texts)
+        self.assertEqual(
+            self.get_texts(content), self.get_texts(create_pdf(certificates))
+        )
+
+    @override_settings(PDF_WORKERS=2)
+    def test_pool(self):
+        """Draw large selection in a pool with the same pages in order."""
+        certificates, _ = create_certificates(pdf_chunk_size + 3, lines=2)
+        self.assertEqual(
+            self.get_texts(get_certificates_pdf(certificates)),
+            self.get_texts(create_pdf(certificates)),
+        )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContractTemplateTest(TestCase):
+    """Broken templates are reported instead of breaking the archive."""
+
+    broken_files = {
+        "contract.doc": b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1\xff",
+        "contract.txt": b"{% if number %}No {{ number }}",
+    }
+
+    def setUp(self):
+        """Log in as a superuser and create contracts."""
+        self.client.force_login(
+            User.objects.create_superuser("admin", password="admin")
+        )
+        certificates, _ = create_certificates(2, lines=0)
+        self.contracts = [certificate.contract for certificate in certificates]
+
+    def get_template(self, name: str, content: bytes) -> ContractTemplate:
+        """Create template with the file."""
+        return ContractTemplate.objects.create(
+            name=name, file=SimpleUploadedFile(name, content)
+        )
+
+    def download(self, template: ContractTemplate):
+        """Download contracts of the template with the admin action."""
+        for contract in self.contracts:
+            contract.template = template
+            contract.save()
+        return self.client.post(
+            reverse("admin:salary_contract_changelist"),
+            {
+                "action": "download_contracts",
+                "_selected_action": [
+                    contract.id for contract in self.contracts
+                ],
+            },
+        )
+
+    def test_upload_broken_template(self):
+        """Reject broken template on upload."""
+        for name, content in self.broken_files.items():
+            with self.subTest(name=name):
+                form = ContractTemplateForm(
+                    {"name": name, "is_active": True},
+                    {"file": SimpleUploadedFile(name, content)},
+                )
+                self.assertIn("file", form.errors)
+
+    def test_download_broken_template(self):
+        """Report broken template before streaming."""
+        for name, content in self.broken_files.items():
+            with self.subTest(name=name):
+                response = self.download(self.get_template(name, content))
+                self.assertEqual(response.status_code, 302)
+                self.assertIn(
+                    f"{name}: ",
+                    [
+                        str(message)[: len(name) + 2]
+                        for message in get_messages(response.wsgi_request)
+                    ],
+                )
+
+    def test_download(self):
+        """Fill text template for every contract."""
+        response = self.download(
+            self.get_template("contract.txt", b"No {{ number }}")
+        )
+        content = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(
+                sorted(archive.read(name) for name in archive.namelist()),
+                [
+                    f"No {contract.number}".encode()
+                    for contract in self.contracts
+                ],
+            )
+
+    def test_download_quotes(self):
+        """Keep quotes in text, escape them in xml."""
+        for contract in self.contracts:
+            contract.employee.bank = 'ПАО "Сбербанк"'
+            contract.employee.save()
+        response = self.download(
+            self.get_template("contract.txt", b"{{ employee.bank }}")
+        )
+        content = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(
+                {archive.read(name).decode() for name in archive.namelist()},
+                {'ПАО "Сбербанк"'},
+            )
+
+    def test_download_odt(self):
+        """Keep mimetype first and parts compression of odt."""
+        template = io.BytesIO()
+        with zipfile.ZipFile(template, "w") as archive:
+            archive.writestr(
+                "content.xml",
+                "<text:p>No {{ number }} {{ employee.bank }}</text:p>",
+                zipfile.ZIP_DEFLATED,
+            )
+            archive.writestr("Pictures/logo.png", b"png", zipfile.ZIP_STORED)
+            archive.writestr(
+                "mimetype",
+                "application/vnd.oasis.opendocument.text",
+                zipfile.ZIP_DEFLATED,
+            )
+        self.contracts[0].employee.bank = 'ПАО "Сбербанк"'
+        self.contracts[0].employee.save()
+        response = self.download(
+            self.get_template("contract.odt", template.getvalue())
+        )
+        content = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            name = sorted(archive.namelist())[0]
+            with zipfile.ZipFile(archive.open(name)) as contract:
+                self.assertEqual(
+                    [
+                        (part.filename, part.compress_type)
+                        for part in contract.infolist()
+                    ],
+                    [
+                        ("mimetype", zipfile.ZIP_STORED),
+                        ("content.xml", zipfile.ZIP_DEFLATED),
+                        ("Pictures/logo.png", zipfile.ZIP_STORED),
+                    ],
+                )
+                self.assertIn(
+                    "No 1000000 ПАО &quot;Сбербанк&quot;",
+                    contract.read("content.xml").decode(),
+                )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PDF_WORKERS=2)
+class ContractPoolTest(TransactionTestCase):
+    """Large selections of contracts are filled in a pool."""
+
+    def test_pool(self):
+        """Fill compiled template in forked workers for every contract."""
+        certificates, _ = create_certificates(pdf_chunk_size + 3, lines=0)
+        template = ContractTemplate.objects.create(
+            name="contract.txt",
+            file=SimpleUploadedFile("contract.txt", b"No {{ number }}"),
+        )
+        contracts = Contract.objects.filter(
+            id__in=[certificate.contract_id for certificate in certificates]
+        )
+        contracts.update(template=template)
+        self.assertEqual(check_templates([template]), {})
+        content = b"".join(iter_contracts_zip(contracts))
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(
+                sorted(archive.read(name) for name in archive.namelist()),
+                sorted(
+                    f"No {number}".encode()
+                    for number in contracts.values_list("number", flat=True)
+                ),
+            )